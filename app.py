@@ -1,11 +1,15 @@
 import pandas as pd
+import numpy as np
 import os
+import functools
+import hashlib
 import eel
 import tkinter as tk
 from openpyxl.styles import Alignment
 from tkinter import filedialog
 from openpyxl import load_workbook
 import sys
+from importlib.util import find_spec
 from pathlib import Path
 import re
 
@@ -15,18 +19,21 @@ sys.path.insert(0, str(project_root))
 
 from config import Config
 
+# --- Excel Readers ---
+# The Rust calamine parser is much faster on large exports; plain openpyxl
+# still works when python-calamine isn't installed
+EXCEL_READ_ENGINE = "calamine" if find_spec("python_calamine") else "openpyxl"
+# Header detection looks at rows 10-19 plus three sample rows after the last one
+RAW_HEADER_SCAN_ROWS = 22
+
 # --- EEL Setup ---
 eel.init(str(Config.WEB_DIR))
 
 # --- Logging Shim ---
-def safe_log(message, level='info'):
-    """Logs messages to the eel frontend if available, otherwise prints to console."""
-    if hasattr(eel, 'logMessage'):
-        try:
-            eel.logMessage(message, level)
-            return
-        except Exception:
-            pass
+# The frontend's exposed JS functions are fixed once eel.init has scanned the
+# web directory, so pick the log/complete targets once instead of per call.
+def _console_log(message, level='info'):
+    """Prints a log message to the console."""
     prefix = level.upper()
     try:
         print(f"[{prefix}] {message}")
@@ -34,16 +41,27 @@ def safe_log(message, level='info'):
         safe = str(message).encode('ascii','replace').decode('ascii')
         print(f"[{prefix}] {safe}")
 
-def safe_complete(ok: bool):
-    """Signals completion status to the eel frontend if available."""
-    if hasattr(eel, 'processingComplete'):
-        try:
-            eel.processingComplete(ok)
-            return
-        except Exception:
-            pass
+def _eel_log(message, level='info'):
+    """Logs a message to the eel frontend, printing it if the call fails."""
+    try:
+        eel.logMessage(message, level)
+    except Exception:
+        _console_log(message, level)
+
+def _console_complete(ok: bool):
+    """Prints the completion status to the console."""
     print(f"[STATUS] processingComplete({ok})")
 
+def _eel_complete(ok: bool):
+    """Signals completion status to the eel frontend, printing it if the call fails."""
+    try:
+        eel.processingComplete(ok)
+    except Exception:
+        _console_complete(ok)
+
+safe_log = _eel_log if hasattr(eel, 'logMessage') else _console_log
+safe_complete = _eel_complete if hasattr(eel, 'processingComplete') else _console_complete
+
 @eel.expose
 def select_file(title, file_type):
     """Opens a native file dialog to select a file."""
@@ -129,14 +147,17 @@ class DynamicColumnMapper:
     def get_template_structure(self):
         """Get the template column structure."""
         try:
-            workbook = load_workbook(Config.TEMPLATE_PATH, data_only=True)
+            # Stream just the header row instead of building the whole styled sheet
+            workbook = load_workbook(Config.TEMPLATE_PATH, read_only=True, data_only=True)
             sheet = workbook[Config.TEMPLATE_SHEET_NAME]
+            header_row = next(sheet.iter_rows(min_row=4, max_row=4, values_only=True), ())
+            workbook.close()
 
             input_columns = []
             calendar_columns = []
 
-            for col in range(2, sheet.max_column + 1):
-                cell_value = sheet.cell(row=4, column=col).value
+            for col in range(2, len(header_row) + 1):
+                cell_value = header_row[col - 1]
                 if cell_value and str(cell_value).strip():
                     header_name = str(cell_value).strip()
                     header_lower = header_name.lower()
@@ -166,13 +187,18 @@ class DynamicColumnMapper:
     def analyze_raw_data(self, file_path):
         """Analyze the raw data file structure."""
         try:
-            workbook = load_workbook(file_path, data_only=True)
-            sheet = workbook.sheetnames[0]
-            raw_sheet = workbook[sheet]
+            # Only the first couple of dozen rows are inspected, so stream them in
+            # read-only mode instead of loading the whole sheet
+            workbook = load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                raw_sheet = workbook[workbook.sheetnames[0]]
+                top_rows = list(raw_sheet.iter_rows(values_only=True, max_row=RAW_HEADER_SCAN_ROWS))
+            finally:
+                workbook.close()
 
             for row_num in range(10, 20):
                 try:
-                    row_data = list(raw_sheet.iter_rows(values_only=True, min_row=row_num, max_row=row_num))[0]
+                    row_data = top_rows[row_num - 1]
                     headers = [str(cell).strip() if cell else "" for cell in row_data]
 
                     proper_headers = 0
@@ -193,7 +219,7 @@ class DynamicColumnMapper:
                         sample_data = []
                         for sample_row in range(row_num + 1, row_num + 4):
                             try:
-                                sample_row_data = list(raw_sheet.iter_rows(values_only=True, min_row=sample_row, max_row=sample_row))[0]
+                                sample_row_data = top_rows[sample_row - 1]
                                 sample_data.append([str(cell).strip() if cell else "" for cell in sample_row_data])
                             except:
                                 break
@@ -207,7 +233,7 @@ class DynamicColumnMapper:
                     continue
 
             print("Using fallback row 14 for headers")
-            row_data = list(raw_sheet.iter_rows(values_only=True, min_row=14, max_row=14))[0]
+            row_data = top_rows[13]
             headers = [str(cell).strip() if cell else "" for cell in row_data]
             return {'headers': headers, 'sample_data': [], 'data_start_row': 15}
 
@@ -289,7 +315,67 @@ class DynamicColumnMapper:
         safe_log(f"Successfully mapped {len(mapping)}/{len(template_input_columns)} columns")
         return mapping
 
-# --- Date parsing helper ---
+# --- Report footer exclusions ---
+EXCLUSION_KEYWORDS = [
+    'Confidential Information - Do Not Distribute',
+    'Copyright © 2000-2025 salesforce.com, inc. All rights reserved.'
+]
+EXCLUSION_RE = re.compile('|'.join(map(re.escape, EXCLUSION_KEYWORDS)), re.IGNORECASE)
+
+# --- Currency cleanup table ---
+MONEY_DELETE_TABLE = str.maketrans('', '', '$,')
+
+# --- Raw data cache ---
+def cache_df(read):
+    """
+    Caches a DataFrame reader on disk, keyed by a hash of the input file's bytes
+    and the read arguments. Resent attachments are saved under new names, so the
+    content rather than the path decides a hit; an edited file simply misses.
+    """
+    @functools.wraps(read)
+    def cached_read(path, *args):
+        cache_path = None
+        try:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            digest.update(repr((read.__name__, args)).encode())
+            cache_path = Config.CACHE_DIR / f"{digest.hexdigest()}.pkl"
+            if cache_path.exists():
+                return pd.read_pickle(cache_path)
+        except Exception as e:
+            safe_log(f"Raw data cache unavailable: {e}")
+
+        df = read(path, *args)
+
+        if cache_path is not None:
+            try:
+                Config.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                temp_path = cache_path.with_suffix('.tmp')
+                df.to_pickle(temp_path)
+                os.replace(temp_path, cache_path)
+            except Exception as e:
+                safe_log(f"Could not cache raw data: {e}")
+        return df
+    return cached_read
+
+@cache_df
+def read_raw_columns(data_path, start_row, usecols):
+    """Reads the given raw columns below the header row as stripped strings."""
+    df_raw = pd.read_excel(
+        data_path,
+        sheet_name=0,
+        header=None,
+        skiprows=start_row,
+        usecols=list(usecols),
+        dtype=str,
+        engine=EXCEL_READ_ENGINE
+    )
+    raw_values = np.char.strip(df_raw.fillna("").to_numpy(dtype=str))
+    return pd.DataFrame(raw_values, columns=df_raw.columns, dtype=object)
+
+# --- Date parsing helpers ---
 def parse_date(val):
     """Safely parses a value to a date object, returning original value on failure."""
     try:
@@ -297,6 +383,15 @@ def parse_date(val):
     except:
         return val
 
+def parse_date_column(series):
+    """Parses a whole column to dates at once, falling back to parse_date for stragglers."""
+    parsed = pd.to_datetime(series, errors='coerce')
+    dates = parsed.dt.date.astype(object).where(parsed.notna(), None)
+    retry = parsed.isna() & series.notna() & (series.astype(str).str.strip() != '')
+    if retry.any():
+        dates[retry] = series[retry].map(parse_date)
+    return dates
+
 @eel.expose
 def process_and_merge_files(data_path):
     """
@@ -332,36 +427,17 @@ def process_and_merge_files(data_path):
             safe_complete(False)
             return None
 
-        safe_log(f"Reading and cleaning data from '{Path(data_path).name}'...")
-        wb_raw = load_workbook(data_path, data_only=True)
-        sheet_name = wb_raw.sheetnames[0]
-        sheet_raw = wb_raw[sheet_name]
-
-        raw_values = [
-            [str(cell).strip() if cell is not None else "" for cell in row]
-            for row in sheet_raw.iter_rows(values_only=True)
-        ]
-
-        df_raw = pd.DataFrame(raw_values)
-
-        start_row = raw_data_info.get('data_start_row', 15) - 1
-        df_raw = df_raw.iloc[start_row:].copy()
-
-        if raw_data_info.get('headers') and (len(raw_data_info['headers']) > 0) and (str(raw_data_info['headers'][0]).strip() == ""):
-            df_raw.drop(columns=[0], inplace=True, errors='ignore')
-
-        df_raw.reset_index(drop=True, inplace=True)
-
         mapped_columns = []
         column_names = []
         raw_to_template_mapping = {}
 
         sorted_template_cols = sorted(template_input_columns, key=lambda x: x['index'])
+        raw_width = len(raw_data_info.get('headers', []))
 
         for template_col in sorted_template_cols:
             if template_col['name'] in column_mapping:
                 raw_index = column_mapping[template_col['name']]['raw_index']
-                if raw_index in df_raw.columns:
+                if raw_index < raw_width:
                     mapped_columns.append(raw_index)
                     column_names.append(template_col['name'])
                     raw_to_template_mapping[template_col['name']] = raw_index
@@ -371,51 +447,54 @@ def process_and_merge_files(data_path):
             safe_complete(False)
             return None
 
+        # Let the reader parse only the mapped columns below the header row
+        safe_log(f"Reading and cleaning data from '{Path(data_path).name}'...")
+        start_row = raw_data_info.get('data_start_row', 15) - 1
+        df_raw = read_raw_columns(data_path, start_row, tuple(sorted(set(mapped_columns))))
+
         original_raw_indices = mapped_columns.copy()
         df_raw = df_raw[mapped_columns]
         df_raw.columns = column_names
 
         safe_log(f"DYNAMIC mapping applied: {len(mapped_columns)} columns selected")
-        for i, (col_name, orig_raw_idx) in enumerate(zip(column_names, original_raw_indices)):
-            safe_log(f"  {col_name} <- Raw Column {orig_raw_idx} (now pandas index {i})")
+        if Config.DEBUG:
+            for i, (col_name, orig_raw_idx) in enumerate(zip(column_names, original_raw_indices)):
+                safe_log(f"  {col_name} <- Raw Column {orig_raw_idx} (now pandas index {i})")
 
         template_to_df_index = {name: i for i, name in enumerate(column_names)}
 
-        for col in df_raw.columns:
-            if 'value' in col.lower():
-                try:
-                    df_raw[col] = pd.to_numeric(
-                        df_raw[col].astype(str).str.replace(r'[\$,]', '', regex=True),
-                        errors='coerce'
-                    )
-                except Exception:
-                    pass
+        value_columns = [col for col in df_raw.columns if 'value' in col.lower()]
+        if value_columns:
+            try:
+                # Clean every money column in one flat pass, then fold back to columns
+                money = pd.Series(df_raw[value_columns].to_numpy().ravel())
+                money = pd.to_numeric(money.str.translate(MONEY_DELETE_TABLE), errors='coerce')
+                df_raw[value_columns] = money.to_numpy().reshape(len(df_raw), len(value_columns))
+            except Exception:
+                pass
 
         df = df_raw.dropna(how='all')
         if len(df.columns) > 1:
             df.dropna(subset=[df.columns[1]], inplace=True)
 
-        EXCLUSION_KEYWORDS = [
-            'Confidential Information - Do Not Distribute',
-            'Copyright © 2000-2025 salesforce.com, inc. All rights reserved.'
-        ]
-        for col in df.columns[:2]:
-            df = df[~df[col].astype(str).str.contains('|'.join(EXCLUSION_KEYWORDS), case=False, na=False)]
+        # Normalise the manager column once; the footer exclusion, the total row
+        # and the has-manager test are all derived from it in the same pass
+        first_col = df.columns[0]
+        mgr_text = df[first_col].astype(str).str.strip()
+        mgr_lower = mgr_text.str.lower()
+        exclusion_mask = mgr_text.str.contains(EXCLUSION_RE, na=False)
+        if len(df.columns) > 1:
+            exclusion_mask |= df[df.columns[1]].astype(str).str.contains(EXCLUSION_RE, na=False)
+        keep = ~exclusion_mask.to_numpy()
 
         safe_log("Separating and sorting main data from total row...")
-        df['temp_mgr_lower'] = df[df.columns[0]].astype(str).str.strip().str.lower()
-
-        total_row_mask = df['temp_mgr_lower'] == 'total'
-        total_df = df[total_row_mask].copy()
-        main_df = df[~total_row_mask].copy()
-
-        has_mgr_mask = (main_df['temp_mgr_lower'] != '') & (main_df['temp_mgr_lower'] != 'nan')
-        df_with_mgr = main_df[has_mgr_mask].copy()
-        df_without_mgr = main_df[~has_mgr_mask].copy()
-        df_with_mgr.sort_values(by=df.columns[0], inplace=True)
-
-        df = pd.concat([df_with_mgr, df_without_mgr, total_df], ignore_index=True)
-        df.drop(columns=['temp_mgr_lower'], inplace=True, errors='ignore')
+        # One stable sort on a rank key: managers (alphabetical), then rows
+        # without a manager in their original order, then the total row
+        sort_rank = np.where(mgr_lower == 'total', 2, np.where(mgr_lower.isin(('', 'nan')), 1, 0))
+        sort_key = df[first_col].where(sort_rank == 0, '')
+        df = df[keep].assign(_sort_rank=sort_rank[keep], _sort_key=sort_key[keep])
+        df = df.sort_values(['_sort_rank', '_sort_key'], kind='stable', ignore_index=True)
+        df.drop(columns=['_sort_rank', '_sort_key'], inplace=True)
 
         safe_log(f"Processed {len(df)} rows of data.")
 
@@ -430,40 +509,55 @@ def process_and_merge_files(data_path):
                 end_row = r - 1
                 break
 
+        # Clear old data across the data block, bounded to the template columns
         total_template_cols = len(template_input_columns) + len(template_calendar_columns)
-        for r_idx in range(Config.DATA_START_ROW, end_row + 1):
-            for c_idx in range(2, total_template_cols + 2):
-                sheet.cell(row=r_idx, column=c_idx).value = None
-
-        for i, row in enumerate(df.itertuples(index=False), start=Config.DATA_START_ROW):
+        for row in sheet.iter_rows(min_row=Config.DATA_START_ROW, max_row=end_row,
+                                   min_col=2, max_col=total_template_cols + 1):
+            for cell in row:
+                cell.value = None
+
+        # Coerce each mapped column once so the write loop only assigns values
+        output_columns = []
+        for template_col_index, template_col in enumerate(sorted_template_cols, start=2):
+            if template_col['name'] not in column_mapping or template_col['name'] not in template_to_df_index:
+                continue
+
+            series = df.iloc[:, template_to_df_index[template_col['name']]]
+            present = series.notna()
+            name_lower = template_col['name'].lower()
+
+            if 'value' in name_lower:
+                numeric = pd.to_numeric(series, errors='coerce')
+                values = numeric.astype(object).where(numeric.notna(), series.astype(object).where(present, None))
+                number_format, format_mask = '$#,##0', numeric.notna()
+            elif 'date' in name_lower:
+                values = parse_date_column(series).where(present, None)
+                number_format, format_mask = 'mm/dd/yyyy', present
+            else:
+                values = series.astype(object).where(present, None)
+                number_format, format_mask = None, None
+
+            output_columns.append((template_col_index, values.tolist(), number_format, format_mask))
+
+        written_rows = len(df) if output_columns else 0
+        for i in range(Config.DATA_START_ROW, Config.DATA_START_ROW + written_rows):
             sheet.row_dimensions[i].height = 30
 
-            template_col_index = 2
-            for template_col in sorted_template_cols:
-                if template_col['name'] in column_mapping and template_col['name'] in template_to_df_index:
-                    df_col_index = template_to_df_index[template_col['name']]
-                    val = row[df_col_index]
-
-                    cell = sheet.cell(row=i, column=template_col_index)
-
-                    if pd.isna(val):
-                        cell.value = None
-                    elif 'value' in template_col['name'].lower():
-                        try:
-                            cell.value = float(str(val).replace(',', '').replace('$',''))
-                            cell.number_format = '$#,##0'
-                        except (ValueError, TypeError):
-                            cell.value = val
-                    elif 'date' in template_col['name'].lower():
-                        cell.value = parse_date(val)
-                        cell.number_format = 'mm/dd/yyyy'
-                    else:
-                        cell.value = val
-
-                    if template_col_index == 3:
-                        cell.alignment = Alignment(wrap_text=True, vertical='top')
-
-                template_col_index += 1
+        # Write column by column; values are already coerced, so the inner loop
+        # is a plain assignment down each column
+        for template_col_index, values, _, _ in output_columns:
+            for i, val in enumerate(values, start=Config.DATA_START_ROW):
+                sheet.cell(row=i, column=template_col_index).value = val
+
+        # Apply formats per column, only on the rows that need them
+        for template_col_index, _, number_format, format_mask in output_columns:
+            if number_format:
+                for offset in format_mask.to_numpy().nonzero()[0]:
+                    sheet.cell(row=Config.DATA_START_ROW + int(offset), column=template_col_index).number_format = number_format
+            if template_col_index == 3:
+                wrap_alignment = Alignment(wrap_text=True, vertical='top')
+                for r_idx in range(Config.DATA_START_ROW, Config.DATA_START_ROW + len(df)):
+                    sheet.cell(row=r_idx, column=template_col_index).alignment = wrap_alignment
 
         downloads_path = Config.get_downloads_path()
         output_filename = Config.DEFAULT_OUTPUT_NAME
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -48,20 +49,30 @@ class Config:
     BACKUP_DIR = PROJECT_ROOT / "template_backups"
     TEMP_DIR = PROJECT_ROOT / "temp_templates"
     LOGS_DIR = PROJECT_ROOT / "logs"
+    CACHE_DIR = PROJECT_ROOT / "cache"
     WEB_DIR = PROJECT_ROOT / "web"
     
     # Processing Configuration
     TEMPLATE_SHEET_NAME = 'Pipeline'
     DATA_START_ROW = 5
     CHECK_INTERVAL_SECONDS = 5
+    # The one debug switch: run_pipeline's DEBUG_MODE and app.py (run as a
+    # subprocess, so it inherits the environment) both read it; set
+    # PIPELINE_DEBUG=0 for production
+    DEBUG = os.getenv("PIPELINE_DEBUG", "1") == "1"
     DEFAULT_OUTPUT_NAME = "C5S&DEC_Pipeline_FINAL_SORTED.xlsx"
     
     # File Extensions
     EXCEL_EXTENSIONS = ['.xlsx', '.xls']
     
+    _dirs_ensured = False
+    
     @classmethod
     def ensure_directories(cls):
         """Create all necessary directories if they don't exist."""
+        if cls._dirs_ensured:
+            return
+        
         directories = [
             cls.INPUT_DIR,
             cls.OUTPUT_DIR, 
@@ -72,6 +83,8 @@ class Config:
         
         for directory in directories:
             directory.mkdir(parents=True, exist_ok=True)
+        
+        cls._dirs_ensured = True
     
     @classmethod
     def validate_config(cls):
@@ -114,9 +127,10 @@ class Config:
         return email_address.lower() in [email.lower() for email in cls.AUTHORIZED_EMAILS]
     
     @classmethod
+    @lru_cache(maxsize=1)
     def get_error_cc_list(cls):
-        """Get the list of emails to CC on error notifications."""
-        return cls.ERROR_RECIPIENTS.copy()
+        """Get the emails to CC on error notifications (a cached, read-only tuple)."""
+        return tuple(cls.ERROR_RECIPIENTS)
 
 # Create directories on import
 Config.ensure_directories()
\ No newline at end of file
@@ -6,12 +6,30 @@ Handles all the edge cases for cleaning email headers to prevent SMTP errors
 
 import re
 import unicodedata
+from functools import lru_cache
+
+# ASCII control characters (the only category C code points below 0x80)
+_CTRL_TABLE = dict.fromkeys([*range(0x20), 0x7f])
+
+def _strip_control_chars(text):
+    """Remove category C characters, via str.translate when the text is ASCII."""
+    if text.isascii():
+        return text.translate(_CTRL_TABLE)
+    return ''.join(char for char in text if unicodedata.category(char)[0] != 'C')
+
+# ASCII control characters that are not allowed in headers (tab is fine)
+_FORBIDDEN_RE = re.compile(r'[\x00-\x08\x0a-\x1f\x7f]')
 
 class EmailHeaderCleaner:
     """
     Comprehensive email header cleaning with multiple fallback strategies.
     """
     
+    # Patterns compiled once for all cleaning calls
+    _WS_RE = re.compile(r'\s+')
+    _MSGID_RE = re.compile(r'<([^<>]+)>')
+    _REFS_RE = re.compile(r'<[^<>]+@[^<>]+>')
+    
     @staticmethod
     def clean_subject(subject):
         """
@@ -26,17 +44,22 @@ class EmailHeaderCleaner:
         if not subject:
             return "Interact with the MAG bot to configure your file"
         
-        # Convert to string and handle Unicode
-        subject = str(subject)
-        
-        # Normalize Unicode characters
-        subject = unicodedata.normalize('NFKD', subject)
+        # Convert to string; the same few subjects recur, so the cleaning is cached
+        return EmailHeaderCleaner._clean_subject_text(str(subject))
+    
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _clean_subject_text(subject):
+        """Clean a non-empty subject string (cached helper for clean_subject)."""
+        # Normalize Unicode characters (ASCII is already in NFKD form)
+        if not subject.isascii():
+            subject = unicodedata.normalize('NFKD', subject)
         
         # Remove control characters (including newlines, carriage returns, tabs)
-        subject = ''.join(char for char in subject if unicodedata.category(char)[0] != 'C')
+        subject = _strip_control_chars(subject)
         
         # Collapse multiple whitespace into single spaces
-        subject = re.sub(r'\s+', ' ', subject)
+        subject = EmailHeaderCleaner._WS_RE.sub(' ', subject)
         
         # Trim whitespace
         subject = subject.strip()
@@ -72,14 +95,14 @@ class EmailHeaderCleaner:
         raw_message_id = str(raw_message_id)
         
         # Remove all control characters
-        cleaned = ''.join(char for char in raw_message_id if unicodedata.category(char)[0] != 'C')
+        cleaned = _strip_control_chars(raw_message_id)
         
         # Remove extra whitespace
-        cleaned = re.sub(r'\s+', '', cleaned)
+        cleaned = EmailHeaderCleaner._WS_RE.sub('', cleaned)
         
         # Message-ID should be in format <localpart@domain>
         # Extract content between < and >
-        match = re.search(r'<([^<>]+)>', cleaned)
+        match = EmailHeaderCleaner._MSGID_RE.search(cleaned)
         if match:
             message_id_content = match.group(1)
             
@@ -107,11 +130,11 @@ class EmailHeaderCleaner:
         
         # Convert to string and remove control characters
         raw_references = str(raw_references)
-        cleaned = ''.join(char for char in raw_references if unicodedata.category(char)[0] != 'C')
+        cleaned = _strip_control_chars(raw_references)
         
         # References is a space-separated list of Message-IDs
         # Extract all valid Message-IDs
-        message_ids = re.findall(r'<[^<>]+@[^<>]+>', cleaned)
+        message_ids = EmailHeaderCleaner._REFS_RE.findall(cleaned)
         
         if message_ids:
             # Return space-separated list of clean Message-IDs
@@ -166,21 +189,32 @@ class EmailHeaderCleaner:
         Validate that all headers are safe for SMTP transmission.
         
         Args:
-            headers_dict (dict): Dictionary of header name -> value
+            headers_dict (dict or EmailMessage): Header name -> value mapping, or the
+                message itself (its headers are read in place, without a copy)
             
         Returns:
             tuple: (is_valid, error_message)
         """
-        for header_name, header_value in headers_dict.items():
+        if hasattr(headers_dict, 'raw_items'):
+            header_items = headers_dict.raw_items()
+        else:
+            header_items = headers_dict.items()
+        
+        for header_name, header_value in header_items:
             if not header_value:
                 continue
             
             header_str = str(header_value)
             
             # Check for control characters that cause SMTP errors
-            for char in header_str:
-                if unicodedata.category(char)[0] == 'C' and char not in ['\t']:
-                    return False, f"Header '{header_name}' contains control character: {repr(char)}"
+            if header_str.isascii():
+                match = _FORBIDDEN_RE.search(header_str)
+                if match:
+                    return False, f"Header '{header_name}' contains control character: {repr(match.group())}"
+            else:
+                for char in header_str:
+                    if unicodedata.category(char)[0] == 'C' and char not in ['\t']:
+                        return False, f"Header '{header_name}' contains control character: {repr(char)}"
             
             # Check for excessively long headers
             if len(header_str) > 1000:
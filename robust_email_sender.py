@@ -5,6 +5,13 @@ Implements the mitigation plan for reliable email threading
 """
 
 import smtplib
+import logging
+import atexit
+import mmap
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 from email.message import EmailMessage
 from email.utils import formatdate, make_msgid
 import os
@@ -18,22 +25,59 @@ sys.path.insert(0, str(project_root))
 from config import Config
 from email_header_cleaner import EmailHeaderCleaner
 
+# MIME types for the attachments this pipeline sends, keyed by file suffix
+_MIME_OVERRIDES = {
+    '.xlsx': ('application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    '.xls': ('application', 'vnd.ms-excel'),
+}
+_DEFAULT_MIME = ('application', 'octet-stream')
+
+# Reconnects wait 1s, then 2s, before giving up on the SMTP server
+SMTP_CONNECT_ATTEMPTS = 3
+SMTP_BACKOFF_SECONDS = 1
+
+# Base64 payloads of attachments sent repeatedly (the shared template), keyed by
+# path and validated against (mtime_ns, size) so a replaced file is re-encoded
+_encoded_attachments = {}
+
+logger = logging.getLogger(__name__)
+_console_handler = None
+
+# Senders that may still hold an SMTP session; weak, so per-call senders are
+# freed as soon as they go out of use
+_live_senders = weakref.WeakSet()
+
+def _close_live_senders():
+    """Quit any SMTP sessions still open when the interpreter exits."""
+    for sender in list(_live_senders):
+        sender.close()
+
+atexit.register(_close_live_senders)
+
+def _enable_console_debug():
+    """Echo this module's log records to the console at DEBUG level (debug=True senders)."""
+    global _console_handler
+    if _console_handler is None:
+        _console_handler = logging.StreamHandler(sys.stdout)
+        _console_handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+        logger.addHandler(_console_handler)
+        logger.setLevel(logging.DEBUG)
+
 class RobustEmailSender:
     """
     Email sender with progressive fallback strategies for threading.
     """
     
     def __init__(self, debug=False):
-        self.debug = debug
+        if debug:
+            _enable_console_debug()
         self.cleaner = EmailHeaderCleaner()
+        self._server = None
+        self._lock = threading.Lock()
+        _live_senders.add(self)
         
-    def log(self, message, level="INFO"):
-        """Log messages if debug mode is enabled."""
-        if self.debug:
-            print(f"[{level}] {message}")
-    
     def send_email(self, to_address, subject, body, attachment_path=None, cc_address=None, 
-                   thread_info=None, force_new_thread=False):
+                   thread_info=None, force_new_thread=False, cache_attachment=False):
         """
         Send email with robust threading and fallback strategies.
         
@@ -48,14 +92,15 @@ class RobustEmailSender:
                 - references: References header chain
                 - subject: Original subject
             force_new_thread (bool): Force sending as new thread (no threading headers)
+            cache_attachment (bool): Reuse the encoded attachment while the file is unchanged
             
         Returns:
             bool: True if sent successfully, False otherwise
         """
         try:
-            self.log(f"Preparing email to {to_address}")
-            self.log(f"Subject: {subject}")
-            self.log(f"Threading enabled: {thread_info is not None and not force_new_thread}")
+            logger.debug("Preparing email to %s", to_address)
+            logger.debug("Subject: %s", subject)
+            logger.debug("Threading enabled: %s", thread_info is not None and not force_new_thread)
             
             # Validate configuration
             if not Config.EMAIL_USER or not Config.EMAIL_PASS:
@@ -71,64 +116,79 @@ class RobustEmailSender:
             # Add CC if provided
             if cc_address:
                 msg['Cc'] = cc_address
-                self.log(f"CC: {cc_address}")
+                logger.debug("CC: %s", cc_address)
             
             # Handle threading with progressive fallbacks
             if thread_info and not force_new_thread:
                 success = self._apply_threading_with_fallbacks(msg, subject, thread_info)
                 if not success:
-                    self.log("All threading strategies failed, sending as new thread", "WARNING")
+                    logger.warning("All threading strategies failed, sending as new thread")
             else:
                 # New thread - just clean the subject
                 msg['Subject'] = self.cleaner.clean_subject(subject)
-                self.log(f"New thread subject: {msg['Subject']}")
+                logger.debug("New thread subject: %s", msg['Subject'])
             
             # Set body
             msg.set_content(body)
             
             # Add attachment if provided
             if attachment_path:
-                self._add_attachment(msg, attachment_path)
+                self._add_attachment(msg, attachment_path, cache_attachment)
             
             # Validate all headers before sending
-            headers_dict = {key: value for key, value in msg.items()}
-            is_valid, error_msg = self.cleaner.validate_headers(headers_dict)
+            is_valid, error_msg = self.cleaner.validate_headers(msg)
             
             if not is_valid:
-                self.log(f"Header validation failed: {error_msg}", "ERROR")
+                logger.error("Header validation failed: %s", error_msg)
                 return False
             
             # Send the email
             return self._send_smtp(msg)
             
         except Exception as e:
-            self.log(f"Email sending failed: {e}", "ERROR")
+            logger.error("Email sending failed: %s", e)
             return False
     
+    def send_batch(self, jobs):
+        """
+        Send several emails back to back over this sender's single SMTP session.
+        
+        Args:
+            jobs (list): Keyword-argument dicts for send_email
+            
+        Returns:
+            list: send_email results, in the same order as jobs
+        """
+        return [self.send_email(**job) for job in jobs]
+    
+    def _pick_strategy(self, thread_info):
+        """
+        Choose the threading strategy from thread_info alone.
+        
+        Full threading applies whenever the original Message-ID can be cleaned;
+        otherwise only the subject can carry the thread.
+        """
+        original_message_id = thread_info.get('message_id')
+        if original_message_id and self.cleaner.extract_message_id(original_message_id):
+            return self._strategy_full_threading
+        return self._strategy_subject_only_threading
+    
     def _apply_threading_with_fallbacks(self, msg, subject, thread_info):
         """
-        Apply threading headers with multiple fallback strategies.
+        Apply the threading strategy picked for this thread_info.
         
         Returns:
             bool: True if threading was successfully applied
         """
-        strategies = [
-            self._strategy_full_threading,
-            self._strategy_simple_threading,
-            self._strategy_subject_only_threading
-        ]
-        
-        for i, strategy in enumerate(strategies, 1):
-            self.log(f"Trying threading strategy {i}/{len(strategies)}")
-            try:
-                if strategy(msg, subject, thread_info):
-                    self.log(f"Threading strategy {i} succeeded")
-                    return True
-            except Exception as e:
-                self.log(f"Threading strategy {i} failed: {e}", "WARNING")
-                continue
+        strategy = self._pick_strategy(thread_info)
+        logger.debug("Using %s", strategy.__name__)
         
-        return False
+        try:
+            return strategy(msg, subject, thread_info)
+        except Exception as e:
+            # Only reachable if building the full headers blows up
+            logger.warning("%s failed, falling back to simple threading: %s", strategy.__name__, e)
+            return self._strategy_simple_threading(msg, subject, thread_info)
     
     def _strategy_full_threading(self, msg, subject, thread_info):
         """
@@ -152,7 +212,7 @@ class RobustEmailSender:
         # Apply headers
         for header_name, header_value in threading_headers.items():
             msg[header_name] = header_value
-            self.log(f"Added {header_name}: {header_value}")
+            logger.debug("Added %s: %s", header_name, header_value)
         
         # Set threaded subject
         original_subject = thread_info.get('subject', subject)
@@ -162,7 +222,7 @@ class RobustEmailSender:
             clean_subject = f"Re: {clean_subject}"
         
         msg['Subject'] = clean_subject
-        self.log(f"Full threading subject: {clean_subject}")
+        logger.debug("Full threading subject: %s", clean_subject)
         
         return True
     
@@ -182,11 +242,11 @@ class RobustEmailSender:
         
         # Only add In-Reply-To (skip References to avoid complexity)
         msg['In-Reply-To'] = clean_msg_id
-        self.log(f"Simple threading - In-Reply-To: {clean_msg_id}")
+        logger.debug("Simple threading - In-Reply-To: %s", clean_msg_id)
         
         # Use consistent subject for threading
         msg['Subject'] = "Re: Interact with the MAG bot to configure your file"
-        self.log(f"Simple threading subject: {msg['Subject']}")
+        logger.debug("Simple threading subject: %s", msg['Subject'])
         
         return True
     
@@ -196,75 +256,147 @@ class RobustEmailSender:
         """
         # Use consistent subject that Gmail will group
         msg['Subject'] = "Re: Interact with the MAG bot to configure your file"
-        self.log(f"Subject-only threading: {msg['Subject']}")
+        logger.debug("Subject-only threading: %s", msg['Subject'])
         
         return True
     
-    def _add_attachment(self, msg, attachment_path):
+    def _add_attachment(self, msg, attachment_path, cache=False):
         """Add file attachment to email message."""
         attachment_file = Path(attachment_path)
         
-        if not attachment_file.exists():
-            raise FileNotFoundError(f"Attachment not found: {attachment_path}")
+        # Determine MIME type
+        maintype, subtype = _MIME_OVERRIDES.get(attachment_file.suffix.lower(), _DEFAULT_MIME)
         
-        with open(attachment_file, 'rb') as f:
-            file_data = f.read()
+        # Opening is the existence check; a missing file fails right here
+        try:
+            f = open(attachment_file, 'rb')
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Attachment not found: {attachment_path}") from None
         
-        # Determine MIME type
-        file_extension = attachment_file.suffix.lower()
-        if file_extension in ['.xlsx', '.xls']:
-            maintype = 'application'
-            subtype = 'vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        else:
-            maintype = 'application'
-            subtype = 'octet-stream'
+        with f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            version = (st.st_mtime_ns, size)
+            cached = _encoded_attachments.get(attachment_path) if cache else None
+            if cached and cached[0] == version:
+                # Same file as last time: attach an empty part and drop in the
+                # already-encoded payload instead of base64-encoding it again
+                msg.add_attachment(b'', maintype=maintype, subtype=subtype, filename=attachment_file.name)
+                msg.get_payload()[-1].set_payload(cached[1])
+            elif size:
+                # Map the file rather than reading a bytes copy; the attachment is
+                # base64-encoded straight from the mapped pages
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as file_data:
+                    msg.add_attachment(
+                        file_data,
+                        maintype=maintype,
+                        subtype=subtype,
+                        filename=attachment_file.name
+                    )
+            else:
+                msg.add_attachment(b'', maintype=maintype, subtype=subtype, filename=attachment_file.name)
         
-        msg.add_attachment(
-            file_data,
-            maintype=maintype,
-            subtype=subtype,
-            filename=attachment_file.name
-        )
+        if cache and not (cached and cached[0] == version):
+            _encoded_attachments[attachment_path] = (version, msg.get_payload()[-1].get_payload())
         
-        self.log(f"Attachment added: {attachment_file.name} ({len(file_data)} bytes)")
+        logger.debug("Attachment added: %s (%d bytes)", attachment_file.name, size)
     
-    def _send_smtp(self, msg):
-        """Send email via SMTP with error handling."""
-        try:
-            self.log(f"Connecting to {Config.SMTP_SERVER}:{Config.SMTP_PORT}")
-            
-            with smtplib.SMTP(Config.SMTP_SERVER, Config.SMTP_PORT) as server:
+    def _connect(self):
+        """Open a new STARTTLS session and log in, backing off between failed connection attempts."""
+        for attempt in range(1, SMTP_CONNECT_ATTEMPTS + 1):
+            logger.debug("Connecting to %s:%s (attempt %d)", Config.SMTP_SERVER, Config.SMTP_PORT, attempt)
+            try:
+                server = smtplib.SMTP(Config.SMTP_SERVER, Config.SMTP_PORT)
+            except (OSError, smtplib.SMTPConnectError) as e:
+                if attempt == SMTP_CONNECT_ATTEMPTS:
+                    raise
+                delay = SMTP_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                logger.warning("SMTP connect failed (%s), retrying in %ss", e, delay)
+                time.sleep(delay)
+                continue
+            try:
                 server.starttls()
                 server.login(Config.EMAIL_USER, Config.EMAIL_PASS)
-                server.send_message(msg)
+            except Exception:
+                server.close()
+                raise
+            return server
+    
+    @contextmanager
+    def session(self):
+        """
+        Hold one SMTP session open for a block of sends and close it afterwards.
+        
+        Connection problems are left to the first send, which logs them and
+        reconnects as usual.
+        """
+        with self._lock:
+            if self._server is None:
+                try:
+                    self._server = self._connect()
+                except Exception as e:
+                    logger.warning("Could not open SMTP session: %s", e)
+        try:
+            yield self
+        finally:
+            self.close()
+    
+    def _send_smtp(self, msg):
+        """Send email via SMTP with error handling, reusing the open session when possible."""
+        try:
+            with self._lock:
+                if self._server is None:
+                    self._server = self._connect()
+                try:
+                    self._server.send_message(msg)
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException) as e:
+                    # The server dropped the idle session, either by closing it or by
+                    # answering the next command with 421; reconnect once and retry
+                    if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code != 421:
+                        raise
+                    logger.warning("SMTP session closed by server (%s), reconnecting", e)
+                    self._server.close()
+                    self._server = self._connect()
+                    self._server.send_message(msg)
             
-            self.log("Email sent successfully!", "SUCCESS")
+            logger.info("Email sent successfully!")
             return True
             
         except smtplib.SMTPAuthenticationError as e:
-            self.log(f"SMTP authentication failed: {e}", "ERROR")
+            logger.error("SMTP authentication failed: %s", e)
             return False
         except smtplib.SMTPRecipientsRefused as e:
-            self.log(f"Recipients refused: {e}", "ERROR")
+            logger.error("Recipients refused: %s", e)
             return False
         except Exception as e:
-            self.log(f"SMTP error: {e}", "ERROR")
+            logger.error("SMTP error: %s", e)
+            self.close()
             return False
+    
+    def close(self):
+        """Close the cached SMTP session, if one is open."""
+        with self._lock:
+            server, self._server = self._server, None
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
 
 def send_email_with_attachment(to_address, subject, body, attachment_path=None, 
                                cc_address=None, thread_info=None, debug=False):
     """
     Convenience function that matches the original interface.
     """
-    sender = RobustEmailSender(debug=debug)
-    return sender.send_email(
-        to_address=to_address,
-        subject=subject,
-        body=body,
-        attachment_path=attachment_path,
-        cc_address=cc_address,
-        thread_info=thread_info
-    )
+    with RobustEmailSender(debug=debug).session() as sender:
+        return sender.send_email(
+            to_address=to_address,
+            subject=subject,
+            body=body,
+            attachment_path=attachment_path,
+            cc_address=cc_address,
+            thread_info=thread_info
+        )
 
 def test_robust_sender():
     """Test the robust email sender with various scenarios."""
@@ -3,8 +3,18 @@
 Production Pipeline with Multi-User Authorization and Enhanced Error Handling
 """
 
+import atexit
 import logging
+import queue
+import re
+import threading
 import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from logging.handlers import QueueHandler, QueueListener
+from string import Template
 import sys
 from pathlib import Path
 
@@ -14,12 +24,12 @@ sys.path.insert(0, str(project_root))
 sys.path.insert(0, str(project_root / "scripts"))
 
 from config import Config
-from scripts.fetch import download_latest_attachment
+from scripts.fetch import iter_events, template_lock
 from scripts.process import generate_gantt_chart
 from robust_email_sender import RobustEmailSender
 
 # Configuration
-DEBUG_MODE = True  # Set to False for production
+DEBUG_MODE = Config.DEBUG  # Set PIPELINE_DEBUG=0 for production
 THREADING_ENABLED = True  # Set to False to disable threading entirely
 
 print("✅ Running PRODUCTION pipeline with Multi-User Support (v9)")
@@ -29,42 +39,71 @@ print(f"👥 Authorized users: {len(Config.AUTHORIZED_EMAILS)}")
 for email in Config.AUTHORIZED_EMAILS:
     print(f"   ✅ {email}")
 
-# Setup logging
+# Setup logging: callers only enqueue records, a background listener formats
+# and writes them to pipeline_log.txt
 Config.ensure_directories()
-logging.basicConfig(
-    filename=Config.LOGS_DIR / "pipeline_log.txt",
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
+_log_file_handler = logging.FileHandler(Config.LOGS_DIR / "pipeline_log.txt")
+_log_file_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+_log_queue = queue.SimpleQueue()
+_root_logger = logging.getLogger()
+_root_logger.setLevel(logging.INFO)
+_log_queue_handler = QueueHandler(_log_queue)
+# Debug senders lower their own logger to DEBUG for a console echo; those
+# records still propagate here, and stay out of the file
+_log_queue_handler.setLevel(logging.INFO)
+_root_logger.addHandler(_log_queue_handler)
+_log_listener = QueueListener(_log_queue, _log_file_handler, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Replies go out on a small worker pool so main() can get back to watching the
+# inbox; each worker thread keeps its own RobustEmailSender and SMTP session
+EMAIL_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="email")
+# Gantt jobs run app.py in a subprocess that always writes the same file in
+# Downloads, so they go one at a time, but off the polling thread
+PROCESSING_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gantt")
+_thread_senders = threading.local()
+
+def _report_job_failure(error):
+    """Log a background job that raised, so the failure does not vanish with its future."""
+    print(f"❌ Background job failed: {error}")
+    logging.error("Background job failed: %s", error, exc_info=error)
+
+def _log_job_failure(future):
+    """Done-callback for pool jobs: report the exception, if any."""
+    if not future.cancelled() and future.exception() is not None:
+        _report_job_failure(future.exception())
+
+def submit_job(pool, fn, *args, **kwargs):
+    """
+    Run fn on pool, reporting any exception it raises. Once the pool has begun
+    shutting down (main() exiting, or a reply failing during the final drain)
+    nothing more is submitted; the job runs on the calling thread instead, so
+    late error emails are still sent.
+    """
+    try:
+        future = pool.submit(fn, *args, **kwargs)
+    except RuntimeError:
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            _report_job_failure(e)
+        return
+    future.add_done_callback(_log_job_failure)
 
-# Initialize robust email sender
-email_sender = RobustEmailSender(debug=DEBUG_MODE)
+def get_email_sender():
+    """Return the calling thread's robust email sender, creating it on first use."""
+    sender = getattr(_thread_senders, 'sender', None)
+    if sender is None:
+        sender = _thread_senders.sender = RobustEmailSender(debug=DEBUG_MODE)
+    return sender
 
-def get_user_greeting(sender_email):
-    """Get personalized greeting based on sender email."""
-    sender_lower = sender_email.lower()
-    
-    if "joseph.findley" in sender_lower or "joe" in sender_lower:
-        return "Joe"
-    elif "rohan" in sender_lower:
-        return "Rohan"
-    elif "person1" in sender_lower:
-        return "Person1"  # Customize as needed
-    elif "person2" in sender_lower:
-        return "Person2"  # Customize as needed
-    else:
-        # Extract first name from email or use generic greeting
-        name_part = sender_email.split('@')[0].split('.')[0]
-        return name_part.title() if name_part else "there"
+# Email bodies, parsed once at import and filled in per message
+_ERROR_CONTACTS = ', '.join(Config.get_error_cc_list())
 
-def send_help_instructions(sender, thread_info=None):
-    """Send help/instructions to user when they start a conversation."""
-    try:
-        greeting_name = get_user_greeting(sender)
-        
-        help_body = f"""MAG Pipeline Automation Assistant
+_HELP_BODY = Template("""MAG Pipeline Automation Assistant
 
-Hello {greeting_name}! 👋
+Hello ${greeting}! 👋
 
 Welcome to your intelligent Salesforce pipeline processing system. I'm here to streamline your workflow and ensure your data is always perfectly formatted.
 
@@ -104,45 +143,11 @@ Your Automated Pipeline Assistant
 
 ---
 Type "Help" anytime to see these instructions again
-"""
-        
-        # Use threading if enabled and thread_info provided
-        use_threading = thread_info if THREADING_ENABLED else None
-        
-        # CC all error recipients for transparency (with safety check)
-        cc_list = Config.get_error_cc_list()
-        # Remove sender from CC list to avoid duplicates
-        cc_list = [email for email in cc_list if email.lower() != sender.lower()]
-        # Use first available CC or fallback to primary admin
-        cc_address = cc_list[0] if cc_list else Config.YOUR_EMAIL
-        
-        success = email_sender.send_email(
-            to_address=sender,
-            subject="Interact with the MAG bot to configure your file",
-            body=help_body,
-            cc_address=cc_address,
-            thread_info=use_threading
-        )
-        
-        if success:
-            print(f"📧 Help instructions sent to {sender}")
-            logging.info(f"Help instructions sent to {sender}")
-        
-        return success
-        
-    except Exception as e:
-        print(f"❌ Failed to send help instructions: {e}")
-        logging.error(f"Failed to send help instructions: {e}")
-        return False
+""")
 
-def send_template_to_user(sender, thread_info=None):
-    """Send the current template to user for modification."""
-    try:
-        greeting_name = get_user_greeting(sender)
-        
-        template_body = f"""📋 Template Customization Request
+_TEMPLATE_REQUEST_BODY = Template("""📋 Template Customization Request
 
-Hello {greeting_name}!
+Hello ${greeting}!
 
 I've attached the current Excel template that powers your pipeline automation system. You can now customize it to match your exact requirements.
 
@@ -189,48 +194,11 @@ Template Management System
 
 ---
 Automated response to your "Change Format" request
-"""
-        
-        if not Config.TEMPLATE_PATH.exists():
-            raise FileNotFoundError(f"Template file not found at {Config.TEMPLATE_PATH}")
-        
-        # Use threading if enabled and thread_info provided
-        use_threading = thread_info if THREADING_ENABLED else None
-        
-        # CC admins for transparency
-        cc_list = Config.get_error_cc_list()
-        cc_list = [email for email in cc_list if email.lower() != sender.lower()]
-        cc_address = cc_list[0] if cc_list else None
-        
-        success = email_sender.send_email(
-            to_address=sender,
-            subject="Template for Column Adjustment",
-            body=template_body,
-            attachment_path=str(Config.TEMPLATE_PATH),
-            cc_address=cc_address,
-            thread_info=use_threading
-        )
-        
-        if success:
-            print(f"📧 Template sent to {sender}")
-            logging.info(f"Template sent to {sender} for column adjustment")
-        
-        return success
-        
-    except Exception as e:
-        print(f"❌ Failed to send template to user: {e}")
-        logging.error(f"Failed to send template to user: {e}")
-        return False
+""")
 
-def send_template_confirmation(sender, success=True, thread_info=None, error_details=None):
-    """Send confirmation email about template update."""
-    try:
-        greeting_name = get_user_greeting(sender)
-        
-        if success:
-            body = f"""✅ Template Update Successful!
+_TEMPLATE_UPDATED_BODY = Template("""✅ Template Update Successful!
 
-Hello {greeting_name}!
+Hello ${greeting}!
 
 Great news! Your template customization has been successfully processed and integrated into the system.
 
@@ -270,14 +238,14 @@ Template Management System
 
 ---
 Automated confirmation of successful template update
-"""
-        else:
-            body = f"""There was an issue updating the template. ❌
+""")
+
+_TEMPLATE_FAILED_BODY = Template("""There was an issue updating the template. ❌
 
 ERROR DETAILS
-{error_details or 'Unknown error occurred'}
+${error_details}
 
-Hello {greeting_name}!
+Hello ${greeting}!
 
 I encountered an issue while trying to update your template. Don't worry - this is easily fixable!
 
@@ -307,7 +275,7 @@ Please check the following and try again:
 
 If you continue experiencing problems after following these steps:
 
-📧 Contact: {', '.join(Config.get_error_cc_list())}
+📧 Contact: ${contacts}
 📞 For: Direct technical support
 
 Best regards,
@@ -318,45 +286,11 @@ Template Management System
 
 ---
 Automated error notification - template update failed
-"""
-        
-        # Use threading if enabled and thread_info provided
-        use_threading = thread_info if THREADING_ENABLED else None
-        
-        subject = "Template Update Confirmation" if success else "Template Update Failed"
-        
-        # CC all error recipients
-        cc_list = Config.get_error_cc_list()
-        cc_list = [email for email in cc_list if email.lower() != sender.lower()]
-        cc_address = cc_list[0] if cc_list else None
-        
-        email_success = email_sender.send_email(
-            to_address=sender,
-            subject=subject,
-            body=body,
-            cc_address=cc_address,
-            thread_info=use_threading
-        )
-        
-        if email_success:
-            print(f"📧 Template confirmation sent to {sender}")
-            logging.info(f"Template update confirmation sent - Success: {success}")
-        
-        return email_success
-        
-    except Exception as e:
-        print(f"❌ Failed to send template confirmation: {e}")
-        logging.error(f"Failed to send template confirmation: {e}")
-        return False
+""")
 
-def send_successful_processing_email(sender, final_file, thread_info=None):
-    """Send successful processing notification with file."""
-    try:
-        greeting_name = get_user_greeting(sender)
-        
-        success_body = f"""✅ Pipeline Processing Complete!
+_PROCESSED_BODY = Template("""✅ Pipeline Processing Complete!
 
-Hello {greeting_name}!
+Hello ${greeting}!
 
 Your Salesforce pipeline has been successfully processed and is ready for use. I've transformed your raw data into a polished, presentation-ready format.
 
@@ -414,42 +348,10 @@ Your Automated Pipeline Specialist
 🎊 Another successful pipeline transformation complete! Ready for your next file.
 
 ---
-Pipeline processed at {time.strftime('%Y-%m-%d %H:%M:%S')}
-"""
-        
-        # Use threading if enabled and thread_info provided
-        use_threading = thread_info if THREADING_ENABLED else None
-        
-        # CC admins for transparency
-        cc_list = Config.get_error_cc_list()
-        cc_list = [email for email in cc_list if email.lower() != sender.lower()]
-        cc_address = cc_list[0] if cc_list else None
-        
-        success = email_sender.send_email(
-            to_address=sender,
-            subject="Your Processed Salesforce Pipeline",
-            body=success_body,
-            attachment_path=final_file,
-            cc_address=cc_address,
-            thread_info=use_threading
-        )
-        
-        if success:
-            logging.info(f"Pipeline processed and sent successfully to {sender}")
-            print("✅ Pipeline processing completed successfully.")
-        
-        return success
-        
-    except Exception as e:
-        print(f"❌ Failed to send success email: {e}")
-        logging.error(f"Failed to send success email: {e}")
-        return False
+Pipeline processed at ${timestamp}
+""")
 
-def send_error_alert_email(error_message, sender_email):
-    """Send error alert email to ALL error recipients."""
-    try:
-        alert_subject = "🚨 URGENT: Salesforce Pipeline Automation Error"
-        alert_body = f"""🚨 URGENT: Pipeline System Alert
+_ERROR_ALERT_BODY = Template("""🚨 URGENT: Pipeline System Alert
 
 System Administrators,
 
@@ -459,8 +361,8 @@ The MAG Salesforce Pipeline Automation system has encountered a critical error r
 
 ⚠️ INCIDENT SUMMARY
 
-🕐 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}  
-👤 Affected User: {sender_email}  
+🕐 Time: ${timestamp}  
+👤 Affected User: ${sender_email}  
 📍 Error Location: Pipeline Processing Module  
 ⚡ Status: User Automatically Notified
 
@@ -469,7 +371,7 @@ The MAG Salesforce Pipeline Automation system has encountered a critical error r
 🔍 ERROR DETAILS
 
 Error Message:
-{error_message}
+${error_message}
 
 Impact Level: Service Interruption  
 User Experience: Processing request failed  
@@ -522,44 +424,12 @@ This is an automated alert from your MAG Pipeline Automation System
 ⏰ Response Time Target: < 2 hours | 🎯 Resolution Priority: HIGH
 
 ---
-Sent to all error recipients: {', '.join(Config.get_error_cc_list())}
-"""
-        
-        # Send to ALL error recipients
-        success_count = 0
-        for admin_email in Config.get_error_cc_list():
-            try:
-                success = email_sender.send_email(
-                    to_address=admin_email,
-                    subject=alert_subject,
-                    body=alert_body,
-                    thread_info=None  # Always send errors as new threads
-                )
-                
-                if success:
-                    success_count += 1
-                    print(f"📧 Error alert sent to admin ({admin_email})")
-                    logging.info(f"Error alert email sent to {admin_email}")
-                    
-            except Exception as e:
-                print(f"❌ Failed to send error alert to {admin_email}: {e}")
-                logging.error(f"Error alert email failed for {admin_email}: {e}")
-        
-        return success_count > 0
-        
-    except Exception as e:
-        print(f"❌ Failed to send error alert emails: {e}")
-        logging.error(f"Error alert email system failed: {e}")
-        return False
+Sent to all error recipients: ${contacts}
+""")
 
-def send_error_email_to_user(error_message, sender_email, thread_info=None):
-    """Send error notification email to user."""
-    try:
-        greeting_name = get_user_greeting(sender_email)
-        
-        error_body = f"""⚠️ Temporary Processing Issue
+_USER_ERROR_BODY = Template("""⚠️ Temporary Processing Issue
 
-Hello {greeting_name}!
+Hello ${greeting}!
 
 I wanted to personally let you know that I encountered a technical issue while processing your request. I sincerely apologize for any inconvenience this may cause.
 
@@ -567,7 +437,7 @@ I wanted to personally let you know that I encountered a technical issue while p
 
 🔍 ISSUE SUMMARY
 
-📅 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}  
+📅 Time: ${timestamp}  
 ⚙️ Issue: Technical processing error  
 📊 Your Data: Safely preserved and will be processed once resolved
 
@@ -599,7 +469,7 @@ I wanted to personally let you know that I encountered a technical issue while p
 
 If you have urgent pipeline processing needs that cannot wait:
 
-📧 Direct Contact: {', '.join(Config.get_error_cc_list())}
+📧 Direct Contact: ${contacts}
 📞 For: Immediate manual processing or technical support  
 ⚡ OR Call: (+1)202-961-1540
 
@@ -621,17 +491,278 @@ Pipeline Automation System
 
 ---
 Automated error notification
-"""
+""")
+
+@lru_cache(maxsize=1)
+def _format_body_timestamp(second):
+    """Format one epoch second; cached so a burst of emails shares the result."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+
+def body_timestamp():
+    """Current local time as printed in email bodies, formatted at most once per second."""
+    return _format_body_timestamp(int(time.time()))
+
+# Known senders, in priority order: each branch scans the whole address before
+# the next is tried, so "rohan.joe@..." still greets Joe like the old if/elif chain
+_GREETING_RE = re.compile(
+    r'(?:.*?(?P<Joe>joseph\.findley|joe))'
+    r'|(?:.*?(?P<Rohan>rohan))'
+    r'|(?:.*?(?P<Person1>person1))'  # Customize as needed
+    r'|(?:.*?(?P<Person2>person2))',  # Customize as needed
+    re.IGNORECASE | re.DOTALL
+)
+
+@lru_cache(maxsize=256)
+def get_user_greeting(sender_email):
+    """Get personalized greeting based on sender email."""
+    match = _GREETING_RE.match(sender_email)
+    if match:
+        return match.lastgroup
+    
+    # Extract first name from email or use generic greeting
+    name_part = sender_email.split('@')[0].split('.')[0]
+    return name_part.title() if name_part else "there"
+
+@lru_cache(maxsize=128)
+def _cc_excluding(sender_lower):
+    """Error recipients other than the sender, for the CC line of a reply."""
+    return tuple(email for email in Config.get_error_cc_list() if email.lower() != sender_lower)
+
+def send_help_instructions(sender, thread_info=None):
+    """Send help/instructions to user when they start a conversation."""
+    try:
+        greeting_name = get_user_greeting(sender)
+        
+        help_body = _HELP_BODY.substitute(greeting=greeting_name)
+        
+        # Use threading if enabled and thread_info provided
+        use_threading = thread_info if THREADING_ENABLED else None
+        
+        # CC all error recipients for transparency (with safety check)
+        cc_list = _cc_excluding(sender.lower())
+        # Use first available CC or fallback to primary admin
+        cc_address = cc_list[0] if cc_list else Config.YOUR_EMAIL
+        
+        success = get_email_sender().send_email(
+            to_address=sender,
+            subject="Interact with the MAG bot to configure your file",
+            body=help_body,
+            cc_address=cc_address,
+            thread_info=use_threading
+        )
+        
+        if success:
+            print(f"📧 Help instructions sent to {sender}")
+            logging.info("Help instructions sent to %s", sender)
+        
+        return success
+        
+    except Exception as e:
+        print(f"❌ Failed to send help instructions: {e}")
+        logging.error("Failed to send help instructions: %s", e)
+        return False
+
+def send_template_to_user(sender, thread_info=None):
+    """Send the current template to user for modification."""
+    try:
+        greeting_name = get_user_greeting(sender)
+        
+        template_body = _TEMPLATE_REQUEST_BODY.substitute(greeting=greeting_name)
+        
+        # Use threading if enabled and thread_info provided
+        use_threading = thread_info if THREADING_ENABLED else None
+        
+        # CC admins for transparency
+        cc_list = _cc_excluding(sender.lower())
+        cc_address = cc_list[0] if cc_list else None
+        
+        # A missing template surfaces as a failed send: the sender reports
+        # "Attachment not found" when it opens the file
+        success = get_email_sender().send_email(
+            to_address=sender,
+            subject="Template for Column Adjustment",
+            body=template_body,
+            attachment_path=str(Config.TEMPLATE_PATH),
+            cc_address=cc_address,
+            thread_info=use_threading,
+            cache_attachment=True
+        )
+        
+        if success:
+            print(f"📧 Template sent to {sender}")
+            logging.info("Template sent to %s for column adjustment", sender)
+        
+        return success
+        
+    except Exception as e:
+        print(f"❌ Failed to send template to user: {e}")
+        logging.error("Failed to send template to user: %s", e)
+        return False
+
+def send_template_confirmation(sender, success=True, thread_info=None, error_details=None):
+    """Send confirmation email about template update."""
+    try:
+        greeting_name = get_user_greeting(sender)
+        
+        if success:
+            body = _TEMPLATE_UPDATED_BODY.substitute(greeting=greeting_name)
+        else:
+            body = _TEMPLATE_FAILED_BODY.substitute(
+                greeting=greeting_name,
+                error_details=error_details or 'Unknown error occurred',
+                contacts=_ERROR_CONTACTS
+            )
+        
+        # Use threading if enabled and thread_info provided
+        use_threading = thread_info if THREADING_ENABLED else None
+        
+        subject = "Template Update Confirmation" if success else "Template Update Failed"
+        
+        # CC all error recipients
+        cc_list = _cc_excluding(sender.lower())
+        cc_address = cc_list[0] if cc_list else None
+        
+        email_success = get_email_sender().send_email(
+            to_address=sender,
+            subject=subject,
+            body=body,
+            cc_address=cc_address,
+            thread_info=use_threading
+        )
+        
+        if email_success:
+            print(f"📧 Template confirmation sent to {sender}")
+            logging.info("Template update confirmation sent - Success: %s", success)
+        
+        return email_success
+        
+    except Exception as e:
+        print(f"❌ Failed to send template confirmation: {e}")
+        logging.error("Failed to send template confirmation: %s", e)
+        return False
+
+def send_successful_processing_email(sender, final_file, thread_info=None):
+    """Send successful processing notification with file."""
+    try:
+        greeting_name = get_user_greeting(sender)
+        
+        success_body = _PROCESSED_BODY.substitute(
+            greeting=greeting_name,
+            timestamp=body_timestamp()
+        )
+        
+        # Use threading if enabled and thread_info provided
+        use_threading = thread_info if THREADING_ENABLED else None
+        
+        # CC admins for transparency
+        cc_list = _cc_excluding(sender.lower())
+        cc_address = cc_list[0] if cc_list else None
+        
+        success = get_email_sender().send_email(
+            to_address=sender,
+            subject="Your Processed Salesforce Pipeline",
+            body=success_body,
+            attachment_path=final_file,
+            cc_address=cc_address,
+            thread_info=use_threading
+        )
+        
+        if success:
+            logging.info("Pipeline processed and sent successfully to %s", sender)
+            print("✅ Pipeline processing completed successfully.")
+        
+        return success
+        
+    except Exception as e:
+        print(f"❌ Failed to send success email: {e}")
+        logging.error("Failed to send success email: %s", e)
+        return False
+
+# A recurring failure fires on every poll; alert admins about each distinct
+# error (per affected user) once per window instead of every few seconds
+ALERT_WINDOW_SECONDS = 300
+_RECENT_ALERTS_MAX = 64
+_recent_alerts = OrderedDict()
+_recent_alerts_lock = threading.Lock()
+
+def _alert_recently_sent(error_message, sender_email):
+    """Report whether an identical alert went out in the last ALERT_WINDOW_SECONDS; if not, record this one as sent now."""
+    key = (error_message, sender_email)
+    now = time.monotonic()
+    with _recent_alerts_lock:
+        last_sent = _recent_alerts.get(key)
+        if last_sent is not None and now - last_sent < ALERT_WINDOW_SECONDS:
+            return True
+        _recent_alerts[key] = now
+        _recent_alerts.move_to_end(key)
+        if len(_recent_alerts) > _RECENT_ALERTS_MAX:
+            _recent_alerts.popitem(last=False)
+    return False
+
+def send_error_alert_email(error_message, sender_email, timestamp=None):
+    """Send error alert email to ALL error recipients."""
+    try:
+        if _alert_recently_sent(error_message, sender_email):
+            print("🔕 Duplicate error alert suppressed (already sent to admins recently)")
+            logging.info("Duplicate error alert suppressed: %s", error_message)
+            return True
+        
+        alert_subject = "🚨 URGENT: Salesforce Pipeline Automation Error"
+        alert_body = _ERROR_ALERT_BODY.substitute(
+            contacts=_ERROR_CONTACTS,
+            timestamp=timestamp or body_timestamp(),
+            sender_email=sender_email,
+            error_message=error_message
+        )
+        
+        # Send to ALL error recipients over one SMTP session
+        admin_emails = Config.get_error_cc_list()
+        results = get_email_sender().send_batch([
+            {
+                'to_address': admin_email,
+                'subject': alert_subject,
+                'body': alert_body,
+                'thread_info': None  # Always send errors as new threads
+            }
+            for admin_email in admin_emails
+        ])
+        
+        success_count = 0
+        for admin_email, success in zip(admin_emails, results):
+            if success:
+                success_count += 1
+                print(f"📧 Error alert sent to admin ({admin_email})")
+                logging.info("Error alert email sent to %s", admin_email)
+            else:
+                print(f"❌ Failed to send error alert to {admin_email}")
+                logging.error("Error alert email failed for %s", admin_email)
+        
+        return success_count > 0
+        
+    except Exception as e:
+        print(f"❌ Failed to send error alert emails: {e}")
+        logging.error("Error alert email system failed: %s", e)
+        return False
+
+def send_error_email_to_user(error_message, sender_email, thread_info=None, timestamp=None):
+    """Send error notification email to user."""
+    try:
+        greeting_name = get_user_greeting(sender_email)
+        
+        error_body = _USER_ERROR_BODY.substitute(
+            greeting=greeting_name,
+            contacts=_ERROR_CONTACTS,
+            timestamp=timestamp or body_timestamp()
+        )
         
         # Use threading if enabled and thread_info provided
         use_threading = thread_info if THREADING_ENABLED else None
         
         # CC admins on error notifications
-        cc_list = Config.get_error_cc_list()
-        cc_list = [email for email in cc_list if email.lower() != sender_email.lower()]
+        cc_list = _cc_excluding(sender_email.lower())
         cc_address = cc_list[0] if cc_list else None
         
-        success = email_sender.send_email(
+        success = get_email_sender().send_email(
             to_address=sender_email,
             subject="Pipeline Processing Error",
             body=error_body,
@@ -641,13 +772,13 @@ Automated error notification
         
         if success:
             print(f"📧 Error notification sent to user ({sender_email})")
-            logging.info(f"Error notification email sent to user: {sender_email}")
+            logging.info("Error notification email sent to user: %s", sender_email)
         
         return success
         
     except Exception as e:
         print(f"❌ Failed to send error email to user: {e}")
-        logging.error(f"Error email to user failed: {e}")
+        logging.error("Error email to user failed: %s", e)
         return False
 
 def handle_error(error_message, sender_email=None, thread_info=None):
@@ -655,14 +786,151 @@ def handle_error(error_message, sender_email=None, thread_info=None):
     print(f"🚨 PIPELINE ERROR: {error_message}")
     
     # Log the error
-    logging.error(f"Pipeline error: {error_message} (sender: {sender_email})")
+    logging.error("Pipeline error: %s (sender: %s)", error_message, sender_email)
+    
+    # Both emails report the moment of the error, not when a pool worker got to them
+    timestamp = body_timestamp()
     
     # Send alert email to ALL admins
-    send_error_alert_email(error_message, sender_email or "Unknown")
+    submit_job(EMAIL_POOL, send_error_alert_email, error_message, sender_email or "Unknown", timestamp)
     
     # Send error email to user (with threading if available)
     if sender_email:
-        send_error_email_to_user(error_message, sender_email, thread_info)
+        submit_job(EMAIL_POOL, send_error_email_to_user, error_message, sender_email, thread_info, timestamp)
+
+def _send_reply(send, send_args, success_message, failure_message, sender, thread_info):
+    """Run one reply helper; log success or escalate the failure through handle_error."""
+    if send(*send_args):
+        logging.info(success_message)
+    else:
+        handle_error(failure_message, sender, thread_info)
+
+def queue_reply(send, send_args, success_message, failure_message, sender, thread_info):
+    """Send a reply on the email pool instead of blocking the polling loop."""
+    submit_job(EMAIL_POOL, _send_reply, send, send_args, success_message, failure_message, sender, thread_info)
+
+def _handle_start_conversation(result):
+    """User wants to start a new conversation."""
+    sender = result[1]
+    print(f"🚀 Starting new conversation with {sender}")
+    
+    queue_reply(
+        send_help_instructions, (sender, None),  # Don't thread the initial welcome
+        f"New conversation started with {sender}",
+        "Failed to send conversation starter", sender, None
+    )
+
+def _handle_adjust_columns(result, threaded):
+    """User wants to Change Format - send them the current template."""
+    sender, thread_info = result[1], result[3]
+    print(f"🔧 Column adjustment request from {sender}")
+    
+    queue_reply(
+        send_template_to_user, (sender, thread_info if threaded else None),
+        f"Template adjustment request processed for {sender}",
+        "Failed to send template to user", sender, thread_info
+    )
+
+def _handle_template_updated(result, threaded):
+    """User sent back the updated template - confirm success."""
+    sender, thread_info = result[1], result[3]
+    print(f"✅ Template successfully updated by {sender}")
+    
+    submit_job(EMAIL_POOL, send_template_confirmation, sender, success=True, thread_info=thread_info if threaded else None)
+    logging.info("Template successfully updated by %s", sender)
+
+def _handle_template_update_failed(result, threaded):
+    """Template update failed - notify user."""
+    sender, error_details, thread_info = result[1], result[2], result[3]
+    print(f"❌ Template update failed from {sender}: {error_details}")
+    
+    submit_job(EMAIL_POOL, send_template_confirmation, sender, success=False, thread_info=thread_info if threaded else None, error_details=error_details)
+    logging.error("Template update failed from %s: %s", sender, error_details)
+
+def _handle_normal_processing(result, threaded):
+    """Regular pipeline processing, run on the Gantt worker so polling carries on."""
+    file_path, sender, thread_info = result[1], result[2], result[3]
+    print(f"📊 Queued pipeline file from: {sender}")
+    submit_job(PROCESSING_POOL, _process_pipeline_file, file_path, sender, thread_info, threaded)
+
+def _process_pipeline_file(file_path, sender, thread_info, threaded):
+    """Generate the Gantt workbook for one input file and queue the reply."""
+    print(f"📊 Processing pipeline file from: {sender}")
+    
+    try:
+        # app.py and the template must not change underneath a running job
+        with template_lock:
+            final_file = generate_gantt_chart(file_path)
+        print(f"📄 Generated file: {final_file}")
+        
+        queue_reply(
+            send_successful_processing_email, (sender, final_file, thread_info if threaded else None),
+            f"Pipeline processed and sent successfully to {sender}",
+            "Failed to send processed file", sender, thread_info
+        )
+        
+    except Exception as e:
+        error_msg = f"Processing failed for {sender}: {str(e)}"
+        handle_error(error_msg, sender, thread_info)
+
+def _handle_thread_unclear(result):
+    """Thread message was unclear - send help."""
+    sender, thread_info = result[1], result[3]
+    print(f"❓ Unclear thread message from {sender}")
+    
+    queue_reply(
+        send_help_instructions, (sender, thread_info),
+        f"Unclear message help sent to {sender}",
+        "Failed to send unclear message help", sender, thread_info
+    )
+
+def _handle_help(result):
+    """Legacy help request."""
+    sender = result[1]
+    print(f"ℹ️ Help request from {sender}")
+    
+    queue_reply(
+        send_help_instructions, (sender, None),  # Don't thread legacy help
+        f"Help instructions sent to {sender}",
+        "Failed to send help instructions", sender, None
+    )
+
+def _handle_message_failed(result):
+    """An email kept failing and was flagged seen - alert the admins."""
+    sender, error_details = result[1], result[2]
+    print(f"❌ Set aside email from {sender}: {error_details}")
+    
+    # Admins only: the sender was never verified for this message
+    handle_error(f"Email from {sender} could not be handled. {error_details}")
+
+def _handle_unknown(result):
+    """Action types without a handler are reported and otherwise ignored."""
+    print(f"⚠️ No handler for action: {result[0]}")
+
+# Action type -> handler; THREAD_ variants reply inside the user's thread
+ACTION_HANDLERS = {
+    "START_CONVERSATION": _handle_start_conversation,
+    "ADJUST_COLUMNS": partial(_handle_adjust_columns, threaded=False),
+    "THREAD_ADJUST_COLUMNS": partial(_handle_adjust_columns, threaded=True),
+    "TEMPLATE_UPDATED": partial(_handle_template_updated, threaded=False),
+    "THREAD_TEMPLATE_UPDATED": partial(_handle_template_updated, threaded=True),
+    "TEMPLATE_UPDATE_FAILED": partial(_handle_template_update_failed, threaded=False),
+    "THREAD_TEMPLATE_UPDATE_FAILED": partial(_handle_template_update_failed, threaded=True),
+    "NORMAL_PROCESSING": partial(_handle_normal_processing, threaded=False),
+    "THREAD_NORMAL_PROCESSING": partial(_handle_normal_processing, threaded=True),
+    "THREAD_UNCLEAR": _handle_thread_unclear,
+    "HELP": _handle_help,
+    "MESSAGE_FAILED": _handle_message_failed,
+}
+
+def process_result(result):
+    """Act on one (action_type, ...) tuple returned by download_latest_attachment()."""
+    if not result:
+        return
+
+    action_type = result[0]
+    print(f"🎯 Action detected: {action_type}")
+    ACTION_HANDLERS.get(action_type, _handle_unknown)(result)
 
 def main():
     """Main pipeline loop with multi-user support."""
@@ -673,140 +941,37 @@ def main():
         
     except ValueError as e:
         print(f"❌ Configuration error: {e}")
-        logging.error(f"Configuration error: {e}")
+        logging.error("Configuration error: %s", e)
         return
     
     print(f"🔄 Starting pipeline monitoring (checking every {Config.CHECK_INTERVAL_SECONDS} seconds)")
     print("👥 Multi-User Support: ACTIVE")
     print(f"📧 Error recipients: {', '.join(Config.get_error_cc_list())}")
     
-    while True:
-        # Only show detailed checking message occasionally in debug mode
-        if DEBUG_MODE:
-            check_count = getattr(main, 'check_count', 0) + 1
-            main.check_count = check_count
-            if check_count % 12 == 1:  # Every minute (12 * 5 seconds)
-                print("🔍 Monitoring for emails... (showing every 60 seconds)")
-        
-        try:
-            print("🔍 DEBUG: About to call download_latest_attachment()")
-            result = download_latest_attachment()
-            print(f"🔍 DEBUG: download_latest_attachment() returned: {result}")
-            print(f"🔍 DEBUG: Result type: {type(result)}")
-            
-            if result:
-                action_type = result[0]
-                print(f"🎯 Action detected: {action_type}")
-                
-                if action_type == "START_CONVERSATION":
-                    # User wants to start a new conversation
-                    sender = result[1]
-                    subject = result[2]
-                    thread_info = result[3]
-                    print(f"🚀 Starting new conversation with {sender}")
-                    
-                    if send_help_instructions(sender, None):  # Don't thread the initial welcome
-                        logging.info(f"New conversation started with {sender}")
-                    else:
-                        handle_error("Failed to send conversation starter", sender, None)
-                
-                elif action_type in ["ADJUST_COLUMNS", "THREAD_ADJUST_COLUMNS"]:
-                    # User wants to Change Format
-                    sender = result[1]
-                    subject = result[2]
-                    thread_info = result[3]
-                    print(f"🔧 Column adjustment request from {sender}")
-                    
-                    # Use threading for THREAD_ADJUST_COLUMNS
-                    use_threading = thread_info if action_type == "THREAD_ADJUST_COLUMNS" else None
-                    
-                    if send_template_to_user(sender, use_threading):
-                        logging.info(f"Template adjustment request processed for {sender}")
-                    else:
-                        handle_error("Failed to send template to user", sender, thread_info)
-                
-                elif action_type in ["TEMPLATE_UPDATED", "THREAD_TEMPLATE_UPDATED"]:
-                    # User sent back the updated template - confirm success
-                    sender = result[1]
-                    template_path = result[2]
-                    thread_info = result[3]
-                    print(f"✅ Template successfully updated by {sender}")
-                    
-                    # Use threading for THREAD_TEMPLATE_UPDATED
-                    use_threading = thread_info if action_type == "THREAD_TEMPLATE_UPDATED" else None
-                    
-                    send_template_confirmation(sender, success=True, thread_info=use_threading)
-                    logging.info(f"Template successfully updated by {sender}")
-                
-                elif action_type in ["TEMPLATE_UPDATE_FAILED", "THREAD_TEMPLATE_UPDATE_FAILED"]:
-                    # Template update failed - notify user
-                    sender = result[1]
-                    error_details = result[2]
-                    thread_info = result[3]
-                    print(f"❌ Template update failed from {sender}: {error_details}")
-                    
-                    # Use threading for THREAD_TEMPLATE_UPDATE_FAILED
-                    use_threading = thread_info if action_type == "THREAD_TEMPLATE_UPDATE_FAILED" else None
-                    
-                    send_template_confirmation(sender, success=False, thread_info=use_threading, error_details=error_details)
-                    logging.error(f"Template update failed from {sender}: {error_details}")
-                
-                elif action_type in ["NORMAL_PROCESSING", "THREAD_NORMAL_PROCESSING"]:
-                    # Regular pipeline processing
-                    file_path = result[1]
-                    sender = result[2]
-                    thread_info = result[3]
-                    print(f"📊 Processing pipeline file from: {sender}")
-                    
-                    try:
-                        final_file = generate_gantt_chart(file_path)
-                        print(f"📄 Generated file: {final_file}")
-                        
-                        # Use threading for THREAD_NORMAL_PROCESSING
-                        use_threading = thread_info if action_type == "THREAD_NORMAL_PROCESSING" else None
-                        
-                        if send_successful_processing_email(sender, final_file, use_threading):
-                            logging.info(f"Pipeline processed and sent successfully to {sender}")
-                        else:
-                            handle_error("Failed to send processed file", sender, thread_info)
-                        
-                    except Exception as e:
-                        error_msg = f"Processing failed for {sender}: {str(e)}"
-                        handle_error(error_msg, sender, thread_info)
-                
-                elif action_type == "THREAD_UNCLEAR":
-                    # Thread message was unclear - send help
-                    sender = result[1]
-                    subject = result[2] 
-                    thread_info = result[3]
-                    print(f"❓ Unclear thread message from {sender}")
-                    
-                    if send_help_instructions(sender, thread_info):
-                        logging.info(f"Unclear message help sent to {sender}")
-                    else:
-                        handle_error("Failed to send unclear message help", sender, thread_info)
-                
-                elif action_type == "HELP":
-                    # Legacy help request
-                    sender = result[1]
-                    subject = result[2]
-                    thread_info = result[3]
-                    print(f"ℹ️ Help request from {sender}")
-                    
-                    if send_help_instructions(sender, None):  # Don't thread legacy help
-                        logging.info(f"Help instructions sent to {sender}")
-                    else:
-                        handle_error("Failed to send help instructions", sender, None)
-                        
-        except Exception as e:
-            # Handle system-level errors (IMAP connection, etc.)
-            error_msg = f"System error: {str(e)}"
-            handle_error(error_msg)
+    # Leaving the loop (Ctrl+C) waits for queued jobs, then their replies, to finish
+    with EMAIL_POOL, PROCESSING_POOL:
+        last_heartbeat = None
+        for result in iter_events():
+            # Only show detailed checking message occasionally in debug mode; checks
+            # are event-driven and back off, so go by the clock, not a check count
             if DEBUG_MODE:
-                import traceback
-                print(traceback.format_exc())
+                now = time.monotonic()
+                if last_heartbeat is None or now - last_heartbeat >= 60:
+                    last_heartbeat = now
+                    print("🔍 Monitoring for emails... (shown at most once a minute)")
+        
+            try:
+                if DEBUG_MODE:
+                    print(f"🔍 DEBUG: iter_events() yielded: {result}")
+                    print(f"🔍 DEBUG: Result type: {type(result)}")
+                process_result(result)
 
-        time.sleep(Config.CHECK_INTERVAL_SECONDS)
+            except Exception as e:
+                # Handle system-level errors (IMAP connection, etc.)
+                error_msg = f"System error: {str(e)}"
+                handle_error(error_msg)
+                if DEBUG_MODE:
+                    print(traceback.format_exc())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
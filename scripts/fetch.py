@@ -1,8 +1,19 @@
 import imaplib
+import atexit
+import binascii
+import os
 import email
+import hashlib
+import itertools
+from email.parser import BytesHeaderParser, BytesParser
 import shutil
 import re
-from datetime import datetime
+import select
+import ssl
+import threading
+import time
+import traceback
+import uuid
 from pathlib import Path
 import sys
 
@@ -12,22 +23,64 @@ sys.path.insert(0, str(project_root))
 
 from config import Config
 
-def backup_current_template():
+COPY_BUFFER_SIZE = 1024 * 1024
+BASE64_CHUNK_CHARS = 64 * 1024
+_BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_BASE64_JUNK = bytes(b for b in range(256) if b not in _BASE64_ALPHABET)
+
+# Headers alone decide most branches; the full MIME parse only runs when a body is needed
+_HEADER_PARSER = BytesHeaderParser()
+_MESSAGE_PARSER = BytesParser()
+
+EXCEL_SUFFIXES = tuple(Config.EXCEL_EXTENSIONS)
+
+# Tokens of an IMAP BODYSTRUCTURE response: parentheses, quoted strings, atoms/NIL
+_BODYSTRUCTURE_TOKEN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+_QUOTED_ESCAPE = re.compile(rb'\\(.)')
+
+# Held while the template and app.py are replaced, and by run_pipeline while a
+# Gantt job runs, so neither sees the other half-done
+template_lock = threading.Lock()
+
+# Skip the NOOP liveness check when the connection was used this recently
+IMAP_KEEPALIVE_SECONDS = 25
+
+# Each empty check doubles the IDLE wait before the next one, up to this cap;
+# IDLE still wakes the loop as soon as mail arrives. Servers without IDLE keep
+# polling every CHECK_INTERVAL_SECONDS
+MAX_CHECK_INTERVAL_SECONDS = 300
+
+# Outcomes of one check_inbox() call
+CHECK_EMPTY = "empty"
+CHECK_CONSUMED = "consumed"
+CHECK_RETRY = "retry"
+
+# A message that fails this many checks in a row is flagged seen and reported
+# to the admins instead of being retried again
+MAX_MESSAGE_ATTEMPTS = 3
+
+# Per-sender UNSEEN searches, built once; Gmail IMAP doesn't like complex OR
+# statements, so each authorized address keeps its own criteria string
+_SEARCH_CRITERIA = [(addr, f'(UNSEEN FROM "{addr}")') for addr in Config.AUTHORIZED_EMAILS]
+
+def backup_current_template(timestamp=None):
     """Create a backup of the current template before replacing it."""
     if Config.TEMPLATE_PATH.exists():
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = timestamp or time.strftime("%Y%m%d_%H%M%S")
         backup_filename = f"template_backup_{timestamp}.xlsx"
         backup_path = Config.BACKUP_DIR / backup_filename
-        shutil.copy2(Config.TEMPLATE_PATH, backup_path)
+        # Data only: the filename already carries the timestamp, and copyfile
+        # uses the kernel fast-copy path on its own
+        shutil.copyfile(Config.TEMPLATE_PATH, backup_path)
         print(f"📋 Template backed up to: {backup_path}")
         return backup_path
     return None
 
-def replace_template(new_template_path):
+def replace_template(new_template_path, timestamp=None):
     """Replace the current template with the new one from authorized user."""
     try:
         # Create backup first
-        backup_path = backup_current_template()
+        backup_path = backup_current_template(timestamp)
         
         # Replace the template
         shutil.copy2(new_template_path, Config.TEMPLATE_PATH)
@@ -39,18 +92,35 @@ def replace_template(new_template_path):
         print(f"❌ Failed to replace template: {e}")
         return False
 
+# (INPUT_DIR mtime_ns, latest path); files only appear or disappear through
+# creates, renames and deletes, all of which bump the directory's mtime
+_latest_input_cache = None
+
 def find_latest_input_file():
     """Find the most recent pipeline input file to use for analysis."""
+    global _latest_input_cache
     try:
-        input_files = list(Config.INPUT_DIR.glob("pipeline_*.xlsx"))
-        if not input_files:
+        dir_mtime = Config.INPUT_DIR.stat().st_mtime_ns
+        if _latest_input_cache and _latest_input_cache[0] == dir_mtime:
+            latest_file = _latest_input_cache[1]
+        else:
+            latest_file = None
+            latest_mtime = None
+            with os.scandir(Config.INPUT_DIR) as entries:
+                for entry in entries:
+                    if not (entry.name.startswith("pipeline_") and entry.name.endswith(".xlsx")):
+                        continue
+                    mtime = entry.stat().st_mtime
+                    if latest_mtime is None or mtime > latest_mtime:
+                        latest_file, latest_mtime = entry.path, mtime
+            _latest_input_cache = (dir_mtime, latest_file)
+
+        if latest_file is None:
             print("⚠️ No input files found for template analysis")
             return None
         
-        # Get the most recent file
-        latest_file = max(input_files, key=lambda f: f.stat().st_mtime)
-        print(f"📂 Found latest input file for analysis: {latest_file.name}")
-        return str(latest_file)
+        print(f"📂 Found latest input file for analysis: {os.path.basename(latest_file)}")
+        return latest_file
         
     except Exception as e:
         print(f"⚠️ Error finding latest input file: {e}")
@@ -186,297 +256,584 @@ def get_email_body(msg):
     
     return body.strip()
 
-def download_latest_attachment():
+def save_attachment(part, path):
+    """Write an attachment part to disk, decoding base64 in 64 KiB slices rather than all at once."""
+    if str(part.get("Content-Transfer-Encoding", "")).strip().lower() != "base64":
+        with open(path, "wb") as f:
+            f.write(part.get_payload(decode=True))
+        return
+
+    encoded = part.get_payload(decode=False)
+    try:
+        with open(path, "wb", buffering=COPY_BUFFER_SIZE) as f:
+            carry = b""
+            for start in range(0, len(encoded), BASE64_CHUNK_CHARS):
+                chunk = encoded[start:start + BASE64_CHUNK_CHARS].encode("ascii", "ignore")
+                chunk = carry + chunk.translate(None, _BASE64_JUNK)
+                usable = len(chunk) - len(chunk) % 4
+                f.write(binascii.a2b_base64(chunk[:usable]))
+                carry = chunk[usable:]
+            if carry:
+                f.write(binascii.a2b_base64(carry + b"=" * (-len(carry) % 4)))
+    except binascii.Error:
+        # Malformed encoding; let the email package apply its lenient decoder
+        with open(path, "wb") as f:
+            f.write(part.get_payload(decode=True))
+
+def _first_excel_attachment(msg):
+    """Return the first attached .xlsx/.xls part, walking the MIME tree once."""
+    for part in msg.walk():
+        if part.get_content_maintype() == "multipart":
+            continue
+        if part.get("Content-Disposition") is None:
+            continue
+
+        filename = part.get_filename()
+        if filename and filename.lower().endswith(EXCEL_SUFFIXES):
+            return part
+    return None
+
+def _install_template(part, sender, thread_info, timestamp, action_prefix=""):
+    """Save an attached template, swap it in and regenerate app.py; returns the action tuple."""
+    # Wait for any Gantt job still reading the current template and app.py
+    with template_lock:
+        return _install_template_locked(part, sender, thread_info, timestamp, action_prefix)
+
+def _install_template_locked(part, sender, thread_info, timestamp, action_prefix):
+    """Body of _install_template; the caller holds template_lock."""
+    temp_template_path = Config.INPUT_DIR / f"new_template_{timestamp}.xlsx"
+    try:
+        save_attachment(part, temp_template_path)
+        print(f"📥 Downloaded new template to: {temp_template_path}")
+
+        if not replace_template(temp_template_path, timestamp):
+            return (f"{action_prefix}TEMPLATE_UPDATE_FAILED", sender, "Failed to replace template", thread_info)
+    except Exception as e:
+        print(f"❌ Error saving template: {e}")
+        return (f"{action_prefix}TEMPLATE_UPDATE_FAILED", sender, str(e), thread_info)
+
+    try:
+        # Find the latest input file and pass it to template analyzer
+        latest_input_file = find_latest_input_file()
+
+        from template_analyzer import analyze_template_and_update_app
+        print(f"🔍 Running template analyzer with input file: {latest_input_file}")
+
+        if analyze_template_and_update_app(latest_input_file):
+            return (f"{action_prefix}TEMPLATE_UPDATED", sender, str(temp_template_path), thread_info)
+        return (f"{action_prefix}TEMPLATE_UPDATE_FAILED", sender, "Failed to update app.py", thread_info)
+    except Exception as e:
+        print(f"❌ Error during app update: {e}")
+        print(traceback.format_exc())
+        return (f"{action_prefix}TEMPLATE_UPDATE_FAILED", sender, str(e), thread_info)
+
+def _save_pipeline_file(part, sender, thread_info, timestamp, action_type):
+    """Save an attached pipeline workbook to input/; returns the action tuple or None on failure."""
+    saved_path = Config.INPUT_DIR / f"pipeline_{timestamp}.xlsx"
+    try:
+        save_attachment(part, saved_path)
+    except Exception as e:
+        print(f"❌ Error saving attachment: {e}")
+        return None
+
+    print(f"📥 Saved pipeline data from {sender} to: {saved_path}")
+    return (action_type, str(saved_path), sender, thread_info)
+
+def fetch_full_message(mail, email_id):
+    """Fetch and parse the complete message once a branch needs its body or attachments."""
+    status, msg_data = mail.fetch(email_id, "(BODY.PEEK[])")
+    if status != "OK":
+        print("❌ Failed to fetch email body")
+        return None
+    return _MESSAGE_PARSER.parsebytes(msg_data[0][1])
+
+def _parse_imap_list(data):
+    """Parse a parenthesised IMAP response into nested lists of str (NIL becomes None)."""
+    stack = [[]]
+    for token in _BODYSTRUCTURE_TOKEN.findall(data):
+        if token == b"(":
+            stack.append([])
+        elif token == b")":
+            done = stack.pop()
+            stack[-1].append(done)
+        elif token.startswith(b'"'):
+            stack[-1].append(_QUOTED_ESCAPE.sub(rb"\1", token[1:-1]).decode("utf-8", "replace"))
+        else:
+            stack[-1].append(None if token.upper() == b"NIL" else token.decode("ascii", "replace"))
+    if len(stack) != 1:
+        raise ValueError("unbalanced parentheses")
+    return stack[0]
+
+def _param_dict(values):
+    """Turn an IMAP ("key" "value" ...) parameter list into a dict with lower-cased keys."""
+    if not isinstance(values, list):
+        return {}
+    return {str(key).lower(): value for key, value in zip(values[::2], values[1::2])}
+
+def _excel_section(structure, prefix=""):
     """
-    Download latest attachment and handle different email types from ANY authorized user.
+    Return the IMAP section number ("2", "1.3", ...) of the first Excel attachment in a
+    parsed BODYSTRUCTURE, matching what _first_excel_attachment() would pick.
     """
+    if structure and isinstance(structure[0], list):
+        # Multipart: the child bodies come first, then the subtype and extensions
+        for number, child in enumerate(structure, 1):
+            if not isinstance(child, list):
+                break
+            section = _excel_section(child, f"{prefix}{number}.")
+            if section:
+                return section
+        return None
+
+    maintype = str(structure[0]).lower()
+    if maintype == "message":
+        # walk() descends into attached emails; leave those to the full parse
+        raise ValueError("attached message")
+
+    # Disposition follows the body-type fields (text parts carry an extra line count)
+    disposition_index = 9 if maintype == "text" else 8
+    disposition = structure[disposition_index] if len(structure) > disposition_index else None
+    if not isinstance(disposition, list):
+        return None
+
+    filename = _param_dict(disposition[1] if len(disposition) > 1 else None).get("filename") \
+        or _param_dict(structure[2]).get("name")
+    if filename and filename.lower().endswith(EXCEL_SUFFIXES):
+        return prefix.rstrip(".") or "1"
+    return None
+
+def fetch_excel_part(mail, email_id):
+    """
+    Fetch only the first Excel attachment of a message, located through BODYSTRUCTURE,
+    so the text, HTML and inline images are never downloaded. Returns None when the
+    structure has no usable match; callers then fall back to fetch_full_message().
+    """
+    status, data = mail.fetch(email_id, "(BODYSTRUCTURE)")
+    if status != "OK" or not isinstance(data[0], bytes):
+        # Non-ASCII filenames arrive as literals; not worth parsing here
+        return None
+
     try:
-        # Validate configuration first
-        if not Config.EMAIL_PASS:
-            print("❌ Email password not configured in environment variables")
+        response = _parse_imap_list(data[0])
+        fields = response[1]
+        structure = fields[fields.index("BODYSTRUCTURE") + 1]
+        if not isinstance(structure[0], list):
+            # A single-part message has no separate MIME header section to fetch
             return None
+        section = _excel_section(structure)
+    except (ValueError, IndexError, TypeError) as e:
+        print(f"⚠️ Could not use BODYSTRUCTURE ({e}), fetching the full message")
+        return None
 
-        print(f"Connecting to {Config.IMAP_SERVER}:{Config.IMAP_PORT} as {Config.EMAIL_USER}")
+    if section is None:
+        return None
+
+    status, data = mail.fetch(email_id, f"(BODY.PEEK[{section}.MIME] BODY.PEEK[{section}])")
+    if status != "OK":
+        return None
+
+    headers = body = None
+    for item in data:
+        if isinstance(item, tuple):
+            if b".MIME]" in item[0]:
+                headers = item[1]
+            else:
+                body = item[1]
+    if headers is None or body is None:
+        return None
+
+    print(f"📎 Fetched attachment section {section} only")
+    return _MESSAGE_PARSER.parsebytes(headers + body)
 
+# Handled-message fingerprints live in the (gitignored) cache directory. Only
+# recent redeliveries matter, so once the file holds twice this many it is
+# rewritten with the newest PROCESSED_IDS_LIMIT
+PROCESSED_IDS_LIMIT = 5000
+_processed_ids = None
+
+def _processed_ids_path():
+    """Where the handled-message fingerprints are stored."""
+    return Config.CACHE_DIR / "processed_ids"
+
+def _load_processed_ids():
+    """Load the recorded fingerprints once per process, oldest first."""
+    global _processed_ids
+    if _processed_ids is None:
+        try:
+            _processed_ids = dict.fromkeys(_processed_ids_path().read_text().split())
+        except FileNotFoundError:
+            _processed_ids = {}
+    return _processed_ids
+
+def is_already_processed(fingerprint):
+    """Check whether a message fingerprint has been handled before."""
+    return fingerprint in _load_processed_ids()
+
+def remember_processed(fingerprint):
+    """Record a message fingerprint so a redelivered copy is skipped."""
+    global _processed_ids
+    processed = _load_processed_ids()
+    processed[fingerprint] = None
+    path = _processed_ids_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if len(processed) <= 2 * PROCESSED_IDS_LIMIT:
+        with open(path, "a") as f:
+            f.write(f"{fingerprint}\n")
+        return
+    _processed_ids = dict.fromkeys(list(processed)[-PROCESSED_IDS_LIMIT:])
+    temp_path = path.with_suffix(".tmp")
+    temp_path.write_text("".join(f"{fp}\n" for fp in _processed_ids))
+    os.replace(temp_path, path)
+
+# Fingerprint -> failed attempts for messages still left unseen
+_failed_attempts = {}
+
+class MailPoller:
+    """Keeps one logged-in IMAP connection open across polls instead of reconnecting each time."""
+
+    def __init__(self):
+        self._mail = None
+        self._last_activity = 0.0
+        # Our own IDLE tags; imaplib builds its tags from the letters A-P only,
+        # so a Z prefix can never collide with a command it issued
+        self._idle_tags = (f"ZIDLE{n}".encode() for n in itertools.count(1))
+
+    def connection(self):
+        """Return a live connection with INBOX selected read-only, reconnecting if the old one dropped."""
+        if self._mail is not None:
+            # A connection used moments ago is trusted as-is; a dead one raises in
+            # the caller, which closes it so the next poll reconnects
+            if time.monotonic() - self._last_activity < IMAP_KEEPALIVE_SECONDS:
+                self._last_activity = time.monotonic()
+                return self._mail
+            try:
+                status, _ = self._mail.noop()
+                if status == "OK":
+                    self._last_activity = time.monotonic()
+                    return self._mail
+            except (imaplib.IMAP4.error, OSError):
+                pass
+            self.close()
+
+        print(f"Connecting to {Config.IMAP_SERVER}:{Config.IMAP_PORT} as {Config.EMAIL_USER}")
         mail = imaplib.IMAP4_SSL(Config.IMAP_SERVER, Config.IMAP_PORT)
         mail.login(Config.EMAIL_USER, Config.EMAIL_PASS)
-        mail.select("inbox")
+        # Polling never writes, so keep INBOX read-only; _mark_seen switches
+        # to read-write just long enough to flag a handled message
+        mail.select("inbox", readonly=True)
+        self._mail = mail
+        self._last_activity = time.monotonic()
+        return mail
+
+    def wait_for_mail(self, timeout):
+        """
+        Block in IMAP IDLE until the server announces new mail or `timeout` seconds pass.
+        Servers without IDLE just get a plain sleep, same as the old poll loop; that
+        sleep is capped at CHECK_INTERVAL_SECONDS, since nothing would cut a
+        backed-off wait short.
+        """
+        poll_sleep = min(timeout, Config.CHECK_INTERVAL_SECONDS)
+        try:
+            mail = self.connection()
+            if "IDLE" not in mail.capabilities:
+                time.sleep(poll_sleep)
+                return
+
+            tag = next(self._idle_tags)
+            mail.send(tag + b" IDLE\r\n")
+            if not mail.readline().startswith(b"+"):
+                raise imaplib.IMAP4.error("server refused IDLE")
+
+            # An update that arrived with the continuation is already buffered and
+            # would never make the socket readable again
+            ready = self._has_buffered_input(mail)
+            if not ready:
+                ready, _, _ = select.select([mail.socket()], [], [], timeout)
+            if ready:
+                # Any untagged update (EXISTS, RECENT, flag changes) is worth a
+                # fresh check; the rest of the burst is drained after DONE
+                if not mail.readline():
+                    raise imaplib.IMAP4.abort("connection closed during IDLE")
+
+            mail.send(b"DONE\r\n")
+            while True:
+                line = mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("connection closed during IDLE")
+                if line.startswith(tag + b" "):
+                    break
+            self._last_activity = time.monotonic()
+        except Exception as e:
+            # Anything escaping here would end iter_events() and the monitor
+            # with it (a failed reconnect or login, select() on a closed socket)
+            print(f"⚠️ IDLE failed, falling back to polling: {e}")
+            self.close()
+            time.sleep(poll_sleep)
+
+    @staticmethod
+    def _has_buffered_input(mail):
+        """True when server data was already read off the socket but not yet consumed."""
+        sock = mail.socket()
+        previous_timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            return bool(mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(previous_timeout)
+
+    def close(self):
+        """Log out and drop the cached connection."""
+        mail, self._mail = self._mail, None
+        if mail is not None:
+            try:
+                mail.logout()
+            except Exception:
+                pass
+
+_mail_poller = MailPoller()
+atexit.register(_mail_poller.close)
+
+def _mark_seen(mail, email_id):
+    """Flag a handled message as read, then return INBOX to read-only mode."""
+    mail.select("inbox")
+    try:
+        mail.store(email_id, "+FLAGS", "\\Seen")
+    finally:
+        mail.select("inbox", readonly=True)
+
+def handle_message(mail, email_id, raw_headers):
+    """
+    Decide what to do with one fetched email and save any attachment it carries.
+    Returns (handled, result): handled is False when the message body could not be
+    fetched, so the caller leaves it unseen for a later check.
+    """
+    # One stamp names every file this message produces; the random suffix keeps
+    # two emails handled within the same second from sharing an input file
+    timestamp = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+    msg = _HEADER_PARSER.parsebytes(raw_headers)
+
+    sender = email.utils.parseaddr(msg["From"])[1]
+    subject = msg.get("Subject", "").strip()
+    # The subject-based commands below all compare against this once-lowered copy
+    subject_lower = subject.lower()
+    
+    print(f"📧 Processing email from: {sender}")
+    print(f"📋 Subject: {subject}")
+
+    # UPDATED: Verify sender is authorized using new method
+    if not Config.is_authorized_user(sender):
+        print(f"⚠️ Unauthorized sender: {sender}")
+        print(f"⚠️ Authorized users: {', '.join(Config.AUTHORIZED_EMAILS)}")
+        return True, None
+
+    print(f"✅ Sender {sender} is authorized")
+
+    # Extract threading information
+    is_thread, thread_info = is_thread_continuation(msg)
+    
+    # Check for "Start conversation" to initiate new thread
+    if subject_lower == "start conversation":
+        print("🚀 NEW CONVERSATION START DETECTED!")
+        return True, ("START_CONVERSATION", sender, subject, thread_info)
+    
+    # If it's a thread continuation, parse body for commands
+    if is_thread:
+        print("🔗 THREAD CONTINUATION DETECTED!")
+        msg = fetch_full_message(mail, email_id)
+        if msg is None:
+            return False, None
+        body_text = get_email_body(msg)
+        print(f"📝 Email body preview: {body_text[:100]}...")
+        
+        # Parse body for commands
+        command = parse_email_body_for_commands(body_text)
+        
+        if command == 'ADJUST_COLUMNS':
+            print("🔧 Change Format command found in thread!")
+            return True, ("THREAD_ADJUST_COLUMNS", sender, subject, thread_info)
+        
+        elif command == 'HERE':
+            print("📥 HERE command found in thread - looking for template...")
+            part = _first_excel_attachment(msg)
+            if part is None:
+                print("❌ No Excel template found in 'Here' thread message.")
+                return True, ("THREAD_TEMPLATE_UPDATE_FAILED", sender, "No attachment found", thread_info)
+            return True, _install_template(part, sender, thread_info, timestamp, "THREAD_")
+        
+        else:
+            # Check for file attachment (normal pipeline processing in thread)
+            part = _first_excel_attachment(msg)
+            if part is None:
+                print("📂 No recognized command or attachment found in thread continuation.")
+                return True, ("THREAD_UNCLEAR", sender, subject, thread_info)
+            return True, _save_pipeline_file(part, sender, thread_info, timestamp, "THREAD_NORMAL_PROCESSING")
+    
+    # Legacy support: Check for old-style subject-based commands (for backward compatibility)
+    else:
+        print("📧 Processing as legacy email (not in thread)")
+        
+        if subject_lower == "change format":
+            print("🔧 LEGACY: Column adjustment request")
+            return True, ("ADJUST_COLUMNS", sender, subject, thread_info)
+
+        # Only the attachment matters here, so try to download just that part
+        part = fetch_excel_part(mail, email_id)
+        if part is None:
+            msg = fetch_full_message(mail, email_id)
+            if msg is None:
+                return False, None
+            part = _first_excel_attachment(msg)
+
+        if subject_lower == "here":
+            print("📥 LEGACY: Template update")
+            if part is None:
+                print("❌ No Excel template found in 'Here' email.")
+                return True, ("TEMPLATE_UPDATE_FAILED", sender, "No attachment found", thread_info)
+            return True, _install_template(part, sender, thread_info, timestamp)
+
+        # Normal pipeline processing (legacy)
+        if part is None:
+            print("📂 No Excel attachment found in the email.")
+            return True, None
+        return True, _save_pipeline_file(part, sender, thread_info, timestamp, "NORMAL_PROCESSING")
+
+    return True, None
+
+def check_inbox():
+    """
+    Handle the newest unread email from ANY authorized user.
+    Returns (status, result): status is CHECK_EMPTY when nothing unread matched,
+    CHECK_CONSUMED when a message was handled (or skipped as a duplicate) and
+    flagged seen, and CHECK_RETRY when it was left unread for a later check.
+    A message that fails MAX_MESSAGE_ATTEMPTS checks is flagged seen anyway and
+    comes back as a MESSAGE_FAILED result so the admins hear about it.
+    """
+    try:
+        # Validate configuration first
+        if not Config.EMAIL_PASS:
+            print("❌ Email password not configured in environment variables")
+            return CHECK_RETRY, None
+
+        mail = _mail_poller.connection()
 
         # FIXED: Search for UNSEEN emails from ANY authorized sender
         # Gmail IMAP doesn't like complex OR statements, so we'll search individually
-        all_email_ids = []
+        # Only the newest id of each result is used, so count the space-separated
+        # ids and slice off the last one instead of splitting the whole list
+        latest_email_id = None
         emails_found = 0
         
-        for email_addr in Config.AUTHORIZED_EMAILS:
+        for email_addr, search_criteria in _SEARCH_CRITERIA:
             try:
-                search_criteria = f'(UNSEEN FROM "{email_addr}")'
                 status, messages = mail.search(None, search_criteria)
-                if status == "OK" and messages[0]:
-                    email_ids = messages[0].split()
-                    all_email_ids.extend(email_ids)
-                    emails_found += len(email_ids)
-                    print(f"📧 Found {len(email_ids)} unread emails from {email_addr}")
+                id_list = messages[0].strip() if status == "OK" and messages[0] else b""
+                if id_list:
+                    found = id_list.count(b" ") + 1
+                    latest_email_id = id_list.rsplit(b" ", 1)[-1]
+                    emails_found += found
+                    print(f"📧 Found {found} unread emails from {email_addr}")
+            except (imaplib.IMAP4.abort, OSError):
+                # The connection itself is gone; let the poller reconnect
+                raise
             except Exception as e:
                 print(f"⚠️ Search failed for {email_addr}: {e}")
                 continue
 
-        if not all_email_ids:
-            mail.logout()
-            return None
+        if latest_email_id is None:
+            return CHECK_EMPTY, None
 
         # Use the most recent email from all found emails
-        latest_email_id = all_email_ids[-1]
         print(f"📧 Processing most recent email (ID: {latest_email_id}) from {emails_found} total found")
 
-        # FIXED: Removed the duplicate conflicting lines that were causing the bug
-        status, msg_data = mail.fetch(latest_email_id, "(RFC822)")
+        # Fetch only the headers first; the body is pulled later by the branches
+        # that actually need it
+        status, msg_data = mail.fetch(latest_email_id, "(BODY.PEEK[HEADER])")
         if status != "OK":
             print("❌ Failed to fetch email")
-            mail.logout()
-            return None
-            
-        raw_email = msg_data[0][1]
-        msg = email.message_from_bytes(raw_email)
+            return CHECK_RETRY, None
 
-        sender = email.utils.parseaddr(msg["From"])[1]
-        subject = msg.get("Subject", "").strip()
-        
-        print(f"📧 Processing email from: {sender}")
-        print(f"📋 Subject: {subject}")
-
-        # UPDATED: Verify sender is authorized using new method
-        if not Config.is_authorized_user(sender):
-            print(f"⚠️ Unauthorized sender: {sender}")
-            print(f"⚠️ Authorized users: {', '.join(Config.AUTHORIZED_EMAILS)}")
-            mail.logout()
-            return None
+        raw_headers = msg_data[0][1]
 
-        print(f"✅ Sender {sender} is authorized")
+        # The header block (Message-ID, Date, Received chain) identifies the
+        # message; skip copies that were already handled but left unseen. A full
+        # SHA-256 keeps a new email from ever colliding with a recorded one
+        fingerprint = hashlib.sha256(raw_headers).hexdigest()
+        if is_already_processed(fingerprint):
+            print(f"⏭️ Email {latest_email_id} was already processed, skipping")
+            _mark_seen(mail, latest_email_id)
+            return CHECK_CONSUMED, None
 
-        # Extract threading information
-        is_thread, thread_info = is_thread_continuation(msg)
-        
-        # Check for "Start conversation" to initiate new thread
-        if subject.lower() == "start conversation":
-            print("🚀 NEW CONVERSATION START DETECTED!")
-            mail.logout()
-            return ("START_CONVERSATION", sender, subject, thread_info)
-        
-        # If it's a thread continuation, parse body for commands
-        if is_thread:
-            print("🔗 THREAD CONTINUATION DETECTED!")
-            body_text = get_email_body(msg)
-            print(f"📝 Email body preview: {body_text[:100]}...")
-            
-            # Parse body for commands
-            command = parse_email_body_for_commands(body_text)
-            
-            if command == 'ADJUST_COLUMNS':
-                print("🔧 Change Format command found in thread!")
-                mail.logout()
-                return ("THREAD_ADJUST_COLUMNS", sender, subject, thread_info)
-            
-            elif command == 'HERE':
-                print("📥 HERE command found in thread - looking for template...")
-                # Look for Excel attachment
-                template_found = False
-                for part in msg.walk():
-                    if part.get_content_maintype() == "multipart":
-                        continue
-                    if part.get("Content-Disposition") is None:
-                        continue
-
-                    filename = part.get_filename()
-                    if filename and any(filename.lower().endswith(ext) for ext in ['.xlsx', '.xls']):
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        temp_template_path = Config.INPUT_DIR / f"new_template_{timestamp}.xlsx"
-
-                        try:
-                            with open(temp_template_path, "wb") as f:
-                                f.write(part.get_payload(decode=True))
-
-                            print(f"📥 Downloaded new template to: {temp_template_path}")
-                            
-                            # Replace the current template
-                            if replace_template(temp_template_path):
-                                try:
-                                    # Find the latest input file and pass it to template analyzer
-                                    latest_input_file = find_latest_input_file()
-                                    
-                                    from template_analyzer import analyze_template_and_update_app
-                                    print(f"🔍 Running template analyzer with input file: {latest_input_file}")
-                                    
-                                    if analyze_template_and_update_app(latest_input_file):
-                                        mail.logout()
-                                        return ("THREAD_TEMPLATE_UPDATED", sender, str(temp_template_path), thread_info)
-                                    else:
-                                        mail.logout()
-                                        return ("THREAD_TEMPLATE_UPDATE_FAILED", sender, "Failed to update app.py", thread_info)
-                                except Exception as e:
-                                    print(f"❌ Error during app update: {e}")
-                                    import traceback
-                                    print(traceback.format_exc())
-                                    mail.logout()
-                                    return ("THREAD_TEMPLATE_UPDATE_FAILED", sender, str(e), thread_info)
-                            else:
-                                mail.logout()
-                                return ("THREAD_TEMPLATE_UPDATE_FAILED", sender, "Failed to replace template", thread_info)
-                                
-                        except Exception as e:
-                            print(f"❌ Error saving template: {e}")
-                            mail.logout()
-                            return ("THREAD_TEMPLATE_UPDATE_FAILED", sender, str(e), thread_info)
-                            
-                        template_found = True
-                        break
-
-                if not template_found:
-                    print("❌ No Excel template found in 'Here' thread message.")
-                    mail.logout()
-                    return ("THREAD_TEMPLATE_UPDATE_FAILED", sender, "No attachment found", thread_info)
-            
-            else:
-                # Check for file attachment (normal pipeline processing in thread)
-                attachment_found = False
-                for part in msg.walk():
-                    if part.get_content_maintype() == "multipart":
-                        continue
-                    if part.get("Content-Disposition") is None:
-                        continue
-
-                    filename = part.get_filename()
-                    if filename and any(filename.lower().endswith(ext) for ext in ['.xlsx', '.xls']):
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        saved_path = Config.INPUT_DIR / f"pipeline_{timestamp}.xlsx"
-
-                        try:
-                            with open(saved_path, "wb") as f:
-                                f.write(part.get_payload(decode=True))
-
-                            print(f"📥 Saved pipeline data from {sender} to: {saved_path}")
-                            mail.logout()
-                            return ("THREAD_NORMAL_PROCESSING", str(saved_path), sender, thread_info)
-                            
-                        except Exception as e:
-                            print(f"❌ Error saving attachment: {e}")
-                            mail.logout()
-                            return None
-                            
-                        attachment_found = True
-                        break
-
-                if not attachment_found:
-                    print("📂 No recognized command or attachment found in thread continuation.")
-                    mail.logout()
-                    return ("THREAD_UNCLEAR", sender, subject, thread_info)
-        
-        # Legacy support: Check for old-style subject-based commands (for backward compatibility)
+        try:
+            handled, result = handle_message(mail, latest_email_id, raw_headers)
+            error = "its body could not be fetched"
+        except (imaplib.IMAP4.abort, OSError):
+            # The connection itself is gone; let the poller reconnect
+            raise
+        except Exception as e:
+            print(f"❌ Handling email {latest_email_id} failed: {e}")
+            print(f"❌ FULL TRACEBACK: {traceback.format_exc()}")
+            handled, result, error = False, None, str(e)
+
+        # Only a message that was handled without crashing is flagged; otherwise
+        # it stays unseen and is picked up again on the next poll. The search
+        # always takes the newest unread id, so a message that keeps failing
+        # would hold back everything behind it; after a few tries, give up on it
+        if handled:
+            _failed_attempts.pop(fingerprint, None)
         else:
-            print("📧 Processing as legacy email (not in thread)")
-            
-            if subject.lower() == "change format":
-                print("🔧 LEGACY: Column adjustment request")
-                mail.logout()
-                return ("ADJUST_COLUMNS", sender, subject, thread_info)
-                
-            elif subject.lower() == "here":
-                print("📥 LEGACY: Template update")
-                # Handle same as before for backward compatibility
-                template_found = False
-                for part in msg.walk():
-                    if part.get_content_maintype() == "multipart":
-                        continue
-                    if part.get("Content-Disposition") is None:
-                        continue
-
-                    filename = part.get_filename()
-                    if filename and any(filename.lower().endswith(ext) for ext in ['.xlsx', '.xls']):
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        temp_template_path = Config.INPUT_DIR / f"new_template_{timestamp}.xlsx"
-
-                        try:
-                            with open(temp_template_path, "wb") as f:
-                                f.write(part.get_payload(decode=True))
-
-                            print(f"📥 Downloaded new template to: {temp_template_path}")
-                            
-                            if replace_template(temp_template_path):
-                                try:
-                                    latest_input_file = find_latest_input_file()
-                                    from template_analyzer import analyze_template_and_update_app
-                                    print(f"🔍 Running template analyzer with input file: {latest_input_file}")
-                                    
-                                    if analyze_template_and_update_app(latest_input_file):
-                                        mail.logout()
-                                        return ("TEMPLATE_UPDATED", sender, str(temp_template_path), thread_info)
-                                    else:
-                                        mail.logout()
-                                        return ("TEMPLATE_UPDATE_FAILED", sender, "Failed to update app.py", thread_info)
-                                except Exception as e:
-                                    print(f"❌ Error during app update: {e}")
-                                    mail.logout()
-                                    return ("TEMPLATE_UPDATE_FAILED", sender, str(e), thread_info)
-                            else:
-                                mail.logout()
-                                return ("TEMPLATE_UPDATE_FAILED", sender, "Failed to replace template", thread_info)
-                                
-                        except Exception as e:
-                            print(f"❌ Error saving template: {e}")
-                            mail.logout()
-                            return ("TEMPLATE_UPDATE_FAILED", sender, str(e), thread_info)
-                            
-                        template_found = True
-                        break
-
-                if not template_found:
-                    print("❌ No Excel template found in 'Here' email.")
-                    mail.logout()
-                    return ("TEMPLATE_UPDATE_FAILED", sender, "No attachment found", thread_info)
-
-            # Normal pipeline processing (legacy)
-            else:
-                attachment_found = False
-                for part in msg.walk():
-                    if part.get_content_maintype() == "multipart":
-                        continue
-                    if part.get("Content-Disposition") is None:
-                        continue
-
-                    filename = part.get_filename()
-                    if filename and any(filename.lower().endswith(ext) for ext in ['.xlsx', '.xls']):
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        saved_path = Config.INPUT_DIR / f"pipeline_{timestamp}.xlsx"
-
-                        try:
-                            with open(saved_path, "wb") as f:
-                                f.write(part.get_payload(decode=True))
-
-                            print(f"📥 Saved pipeline data from {sender} to: {saved_path}")
-                            mail.logout()
-                            return ("NORMAL_PROCESSING", str(saved_path), sender, thread_info)
-                            
-                        except Exception as e:
-                            print(f"❌ Error saving attachment: {e}")
-                            mail.logout()
-                            return None
-                            
-                        attachment_found = True
-                        break
-
-                if not attachment_found:
-                    print("📂 No Excel attachment found in the email.")
-
-        mail.logout()
-        return None
-
-    except imaplib.IMAP4.error as e:
+            attempts = _failed_attempts.get(fingerprint, 0) + 1
+            if attempts < MAX_MESSAGE_ATTEMPTS:
+                _failed_attempts[fingerprint] = attempts
+                return CHECK_RETRY, None
+            _failed_attempts.pop(fingerprint, None)
+            sender = email.utils.parseaddr(_HEADER_PARSER.parsebytes(raw_headers).get("From", ""))[1]
+            print(f"❌ Giving up on email {latest_email_id} after {attempts} attempts")
+            result = ("MESSAGE_FAILED", sender, f"Gave up after {attempts} attempts: {error}", None)
+        remember_processed(fingerprint)
+        _mark_seen(mail, latest_email_id)
+        return CHECK_CONSUMED, result
+
+    except (imaplib.IMAP4.error, OSError) as e:
         print(f"❌ IMAP error: {e}")
-        return None
+        # Drop the pooled connection so the next poll starts a fresh session
+        _mail_poller.close()
+        return CHECK_RETRY, None
     except Exception as e:
         print(f"❌ CRITICAL ERROR in download_latest_attachment: {e}")
-        import traceback
         print(f"❌ FULL TRACEBACK: {traceback.format_exc()}")
-        return None
+        return CHECK_RETRY, None
+
+def download_latest_attachment():
+    """
+    Download latest attachment and handle different email types from ANY authorized user.
+    """
+    return check_inbox()[1]
+
+def iter_events():
+    """
+    Yield the result of each check_inbox() call, waiting in IMAP IDLE between checks
+    so new mail is picked up as soon as the server reports it.
+    A check that consumed a message is followed straight away by another, since
+    IDLE only announces new arrivals; a backlog of unread mail is drained on the
+    same session before idling again. A quiet inbox is checked less and less
+    often, backing off to MAX_CHECK_INTERVAL_SECONDS.
+    """
+    interval = Config.CHECK_INTERVAL_SECONDS
+    while True:
+        status, result = check_inbox()
+        yield result
+        if status == CHECK_CONSUMED:
+            interval = Config.CHECK_INTERVAL_SECONDS
+            continue
+        if status == CHECK_RETRY:
+            # Something failed; retry at the normal pace rather than spinning
+            _mail_poller.wait_for_mail(Config.CHECK_INTERVAL_SECONDS)
+            continue
+        _mail_poller.wait_for_mail(interval)
+        interval = min(interval * 2, MAX_CHECK_INTERVAL_SECONDS)
 
 if __name__ == "__main__":
     try:
@@ -92,6 +92,12 @@ def cleanup_temp_files():
                 file_path.unlink()
                 print(f"🗑️ Cleaned up old temp file: {file_path.name}")
                 
+        # Clean up cached raw data
+        for file_path in Config.CACHE_DIR.glob("*.pkl"):
+            if file_path.stat().st_mtime < seven_days_ago:
+                file_path.unlink()
+                print(f"🗑️ Cleaned up old cache file: {file_path.name}")
+                
         # Clean up output directory (keep recent files)
         for file_path in Config.OUTPUT_DIR.glob("Pipeline_GanttChart_*"):
             if file_path.is_file() and file_path.stat().st_mtime < seven_days_ago:
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Raw Data Cache Test
+Tests the on-disk DataFrame cache in app.py: hits, invalidation and fallback
+"""
+
+import os
+from pathlib import Path
+import sys
+import tempfile
+import unittest
+
+import pandas as pd
+
+# Add project root to Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from config import Config
+import app
+
+
+class RawDataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self._orig_cache_dir = Config.CACHE_DIR
+        Config.CACHE_DIR = self.tmp / "cache"
+
+        self.data_path = self.tmp / "raw.csv"
+        self.data_path.write_text("a,b\n1,2\n3,4\n")
+
+        self.calls = 0
+
+        def read(path, *args):
+            self.calls += 1
+            return pd.read_csv(path)
+
+        self.read = app.cache_df(read)
+
+    def tearDown(self):
+        Config.CACHE_DIR = self._orig_cache_dir
+        self._tmp.cleanup()
+
+    def test_cache_hit(self):
+        first = self.read(self.data_path)
+        second = self.read(self.data_path)
+        self.assertEqual(self.calls, 1)
+        pd.testing.assert_frame_equal(first, second)
+
+    def test_same_content_under_new_name_hits(self):
+        self.read(self.data_path)
+        copy_path = self.tmp / "raw_resent.csv"
+        copy_path.write_bytes(self.data_path.read_bytes())
+        self.read(copy_path)
+        self.assertEqual(self.calls, 1)
+
+    def test_edited_file_misses(self):
+        self.read(self.data_path)
+        self.data_path.write_text("a,b\n5,6\n")
+        df = self.read(self.data_path)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(df["a"].tolist(), [5])
+
+    def test_read_args_are_part_of_the_key(self):
+        self.read(self.data_path, 1)
+        self.read(self.data_path, 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_corrupt_cache_entry_falls_back_to_reader(self):
+        self.read(self.data_path)
+        for entry in Config.CACHE_DIR.glob("*.pkl"):
+            entry.write_bytes(b"not a pickle")
+        df = self.read(self.data_path)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(df["a"].tolist(), [1, 3])
+
+    def test_unwritable_cache_dir_falls_back_to_reader(self):
+        Config.CACHE_DIR.parent.mkdir(parents=True, exist_ok=True)
+        Config.CACHE_DIR.write_text("a file where the cache dir should be")
+        df = self.read(self.data_path)
+        df = self.read(self.data_path)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(df["a"].tolist(), [1, 3])
+        self.assertFalse(any(name.endswith(".tmp") for name in os.listdir(self.tmp)))
+
+    def test_missing_input_still_raises(self):
+        with self.assertRaises(FileNotFoundError):
+            self.read(self.tmp / "missing.csv")
+
+
+if __name__ == "__main__":
+    unittest.main()